@@ -0,0 +1,104 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import synthetic
+
+__doc__ = """
+Check that renders running at the same time in threads don't interfere.
+
+A few synthetic documents, using templates, bitmap pages with textured
+pencils, and a base PDF, are each rendered once on their own.  Then they
+are rendered over and over in a pool of threads, all at once.  Every one
+of these must produce exactly the same bytes as the first.
+"""
+
+# Name: (arguments to synthetic.make_document, render options)
+DOCUMENTS = {
+    'template-only': (dict(pages=1, annotate_every=0, template='Grid'), {}),
+    'grid-notebook': (dict(pages=4, strokes=30, segments=50, template='Grid'), {}),
+    'lines-bitmap': (dict(pages=3, strokes=30, segments=50, template='Lines',
+                          pens=['pencil', 'mechanicalpencil', 'paintbrush']),
+                     dict(page_budget={'segments': 100})),
+    'annotated-pdf': (dict(pdf_pages=4, annotate_every=2, strokes=20, segments=50), {}),
+    'only-annotated': (dict(pages=6, annotate_every=3, strokes=10, template='Grid'),
+                       dict(only_annotated=True, compact=True)),
+}
+
+def render_bytes(path, options):
+    from rmrl import render_to
+
+    out = io.BytesIO()
+    render_to(str(path), out, deterministic=True, **options)
+    return out.getvalue()
+
+def main():
+    parser = argparse.ArgumentParser(description="Stress test concurrent renders in threads.")
+    parser.add_argument('--threads', type=int, default=8, help="Number of renders at once.")
+    parser.add_argument('--rounds', type=int, default=10, help="Times to render each document.")
+    parser.add_argument('--switch-interval', type=float, default=1e-5, help="Seconds between thread switches.  Small values make races more likely.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        template_dir = tmpdir / 'rmrl' / 'templates'
+        template_dir.mkdir(parents=True)
+        (template_dir / 'Grid.svg').write_text(synthetic.make_template())
+        (template_dir / 'Lines.svg').write_text(synthetic.make_template(columns=1, rows=40))
+        # This must be set before rmrl finds the template directory
+        os.environ['XDG_DATA_HOME'] = str(tmpdir)
+
+        paths = {}
+        for seed, (name, (kw, _)) in enumerate(DOCUMENTS.items()):
+            paths[name] = tmpdir / f'{name}.zip'
+            synthetic.make_document(paths[name], seed=seed, **kw)
+
+        expected = {name: hashlib.sha1(render_bytes(paths[name], options)).hexdigest()
+                    for name, (_, options) in DOCUMENTS.items()}
+
+        jobs = [name for _ in range(args.rounds) for name in DOCUMENTS]
+        sys.setswitchinterval(args.switch_interval)
+        start = time.perf_counter()
+        failures = 0
+        with ThreadPoolExecutor(args.threads) as executor:
+            futures = [(name, executor.submit(render_bytes, paths[name], DOCUMENTS[name][1]))
+                       for name in jobs]
+            for name, future in futures:
+                try:
+                    digest = hashlib.sha1(future.result()).hexdigest()
+                except Exception as e:
+                    print(f"{name}: {type(e).__name__}: {e}")
+                    failures += 1
+                    continue
+                if digest != expected[name]:
+                    print(f"{name}: output differs from single-threaded render")
+                    failures += 1
+        wall = time.perf_counter() - start
+
+    print(f"{len(jobs)} renders in {args.threads} threads took {wall:.1f} s; "
+          f"{failures} failed")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
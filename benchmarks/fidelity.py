@@ -0,0 +1,106 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+from pathlib import Path
+import re
+import sys
+import tempfile
+
+import synthetic
+
+__doc__ = """
+Check that the same strokes are drawn the same way, however they get to
+the page.
+
+Each check renders synthetic documents two ways that should agree, and
+prints what differs.  The script exits with an error if any check fails.
+"""
+
+def check_v6_highlighter(tmpdir):
+    # A version 6 file should draw its highlighters as wide as the same
+    # strokes in a version 5 file.
+    from rmrl import svg_pages
+
+    widths = {}
+    for version in (5, 6):
+        path = tmpdir / f'highlighter-v{version}.zip'
+        synthetic.make_document(path, pages=1, strokes=10, segments=20,
+                                version=version, pens=['highlighter'])
+        page = next(svg_pages(str(path), template_alpha=0))
+        widths[version] = [float(w) for w in re.findall(r'stroke-width="([\d.]+)"', page)]
+    if not widths[5]:
+        return ["no highlighter strokes drawn"]
+    if widths[5] != widths[6]:
+        return [f"version 6 highlighter widths {widths[6][:5]}... differ "
+                f"from version 5 {widths[5][:5]}..."]
+    return []
+
+def check_light_inks(tmpdir):
+    # Layers drawn as bitmaps go into the PDF as colors plus a soft mask,
+    # which viewers scale separately.  Scaled down and laid over white, a
+    # light ink must look no darker than it does as vectors: no pixel may
+    # be darker than the ink itself.
+    from PIL import Image
+    from rmrl import document, pens, sources
+    from rmrl.constants import DISPLAY
+    from rmrl.raster import RasterCanvas
+
+    path = tmpdir / 'light-inks.zip'
+    # Color 2 is white, but highlighters are always yellow
+    synthetic.make_document(path, pages=1, strokes=20, segments=50,
+                            pens=['ballpoint', 'fineliner', 'marker', 'highlighter'],
+                            colors=[2])
+    source = sources.get_source(str(path))
+    with source.open('{ID}.content', 'r') as f:
+        page_id = json.load(f)['pages'][0]
+    layer = document.DocumentPage(source, page_id, 0).layers[0]
+    strokes = layer.strokes
+
+    problems = []
+    width, height = DISPLAY['screenwidth'], DISPLAY['screenheight']
+    white = Image.new('RGB', (width // 2, height // 2), (255, 255, 255))
+    for highlighter, ink in ((False, (255, 255, 255)), (True, (255, 233, 74))):
+        layer.strokes = [stroke for stroke in strokes
+                         if (pens.PEN_MAPPING[stroke.pen] is pens.HighlighterPen) == highlighter]
+        canvas = RasterCanvas(width, height)
+        layer.paint_strokes(canvas, vector=False)
+        rgb = canvas.image.convert('RGB').resize(white.size, Image.BILINEAR)
+        alpha = canvas.image.getchannel('A').resize(white.size, Image.BILINEAR)
+        extrema = Image.composite(rgb, white, alpha).getextrema()
+        for channel, ((darkest, _), level) in enumerate(zip(extrema, ink)):
+            if darkest < level - 3:
+                problems.append(f"{len(layer.strokes)} strokes in ink {ink} have "
+                                f"pixels down to {darkest} in channel {channel}")
+    return problems
+
+CHECKS = {
+    'v6-highlighter': check_v6_highlighter,
+    'light-inks': check_light_inks,
+}
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for name, check in CHECKS.items():
+            problems = check(Path(tmpdir))
+            for problem in problems:
+                print(f"{name}: {problem}")
+            failures += bool(problems)
+    print(f"{len(CHECKS)} checks; {failures} failed")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+__doc__ = """
+Check that importing rmrl and its command-line interface stays cheap.
+
+Each run imports rmrl in a fresh interpreter.  This fails if any of the
+heavy dependencies get imported along with it, or if the median import
+time goes over the limit.
+"""
+
+# These should only be imported once a document is actually rendered.
+HEAVY_MODULES = ['reportlab', 'svglib', 'pdfrw', 'PIL', 'lxml', 'pkg_resources']
+
+SCRIPT = f"""
+import sys, time
+start = time.perf_counter()
+import rmrl, rmrl.__main__
+elapsed = time.perf_counter() - start
+print(elapsed)
+print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+def time_import():
+    completed = subprocess.run([sys.executable, '-c', SCRIPT], check=True,
+                               capture_output=True, text=True)
+    elapsed, loaded = completed.stdout.split('\n', 1)
+    return float(elapsed), loaded.split()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the time to import rmrl.")
+    parser.add_argument('--runs', type=int, default=10, help="Number of times to import rmrl.")
+    parser.add_argument('--max-ms', type=float, default=150, help="Fail if the median import time is over this many milliseconds.")
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.runs):
+        elapsed, loaded = time_import()
+        if loaded:
+            print(f"Importing rmrl also imported {', '.join(loaded)}")
+            return 1
+        times.append(elapsed * 1000)
+
+    median = statistics.median(times)
+    print(f"Import time: median {median:.1f} ms, min {min(times):.1f} ms, "
+          f"max {max(times):.1f} ms over {args.runs} runs")
+    if median > args.max_ms:
+        print(f"Median import time is over the limit of {args.max_ms} ms")
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
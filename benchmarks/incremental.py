@@ -0,0 +1,101 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+import zipfile
+
+import synthetic
+
+__doc__ = """
+Check that batch renders again exactly the documents that changed.
+
+A xochitl data directory of synthetic documents is rendered with batch,
+and then again after changing one file of a document at a time: a page
+file rewritten in place, the .pagedata file, or the .metadata file.  Each
+later batch must render that document and no other.
+"""
+
+DOCUMENTS = ['first', 'second', 'third']
+
+def make_library(base_dir):
+    # Returns the ID and the path of the first page file of each document
+    pages = {}
+    for seed, name in enumerate(DOCUMENTS):
+        path = base_dir / f'{name}.zip'
+        doc_id = synthetic.make_document(path, pages=2, strokes=5, segments=10, seed=seed)
+        with zipfile.ZipFile(path) as zf:
+            zf.extractall(base_dir)
+            rm_name = next(n for n in sorted(zf.namelist()) if n.endswith('.rm'))
+        path.unlink()
+        (base_dir / f'{doc_id}.metadata').write_text(json.dumps(
+            {'visibleName': name, 'type': 'DocumentType', 'parent': ''}))
+        pages[name] = (doc_id, base_dir / rm_name)
+    return pages
+
+def rendered(base_dir, output_dir):
+    # The names of the documents that batch renders
+    from rmrl.batch import find_documents, render_batch
+
+    before = {p.name: p.stat().st_mtime_ns for p in output_dir.glob('*.pdf')}
+    _, _, failed, _ = render_batch(find_documents([base_dir]), output_dir, {}, jobs=1)
+    if failed:
+        raise RuntimeError(f"{failed} documents failed to render")
+    return sorted(p.stem for p in output_dir.glob('*.pdf')
+                  if before.get(p.name) != p.stat().st_mtime_ns)
+
+def touch(path):
+    # Make sure the file is newer than anything rendered so far
+    time.sleep(0.01)
+    path.touch()
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        # This must be set before rmrl finds its cache directory
+        os.environ['XDG_CACHE_HOME'] = str(tmpdir / 'cache')
+        base_dir, output_dir = tmpdir / 'xochitl', tmpdir / 'out'
+        base_dir.mkdir()
+        pages = make_library(base_dir)
+        ids = {doc_id: name for name, (doc_id, _) in pages.items()}
+
+        steps = [('first batch', None, sorted(ids)),
+                 ('second batch', None, [])]
+        doc_id, rm_path = pages['first']
+        steps.append(('page file rewritten', rm_path, [doc_id]))
+        doc_id, _ = pages['second']
+        steps.append(('.pagedata changed', base_dir / f'{doc_id}.pagedata', [doc_id]))
+        doc_id, _ = pages['third']
+        steps.append(('.metadata changed', base_dir / f'{doc_id}.metadata', [doc_id]))
+
+        for step, path, expected in steps:
+            if path:
+                touch(path)
+            got = rendered(base_dir, output_dir)
+            if got != expected:
+                print(f"{step}: rendered {[ids[i] for i in got]}, "
+                      f"not {[ids[i] for i in expected]}")
+                failures += 1
+
+    print(f"{len(steps)} batches; {failures} failed")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import importlib
+import io
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import time
+
+import synthetic
+
+__doc__ = """
+Time the main steps of rendering on synthetic documents, and report the
+throughput in segments per second.
+
+Each benchmark is run several times, and the fastest run is reported, as
+the slower ones are most likely slowed by something else on the machine.
+"""
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def report(name, seconds, segments):
+    rate = f"{segments / seconds:>12,.0f}" if segments else f"{'':>12}"
+    print(f"{name:<40} {seconds * 1000:>10.2f} {rate}")
+
+def bench_read_lines(args):
+    from rmrl import lines
+
+    for version in (3, 5):
+        data = synthetic.make_rm(version, strokes=args.strokes, segments=args.segments)
+        seconds = best_time(lambda: lines.readLines(io.BytesIO(data)), args.repeat)
+        report(f"lines.readLines v{version}", seconds, args.strokes * args.segments)
+
+def bench_pens(args):
+    from reportlab.pdfgen import canvas
+    from rmrl import lines, pens
+    from rmrl.constants import PDFHEIGHT, PDFWIDTH
+
+    for name, code in synthetic.PENS.items():
+        data = synthetic.make_rm(strokes=args.strokes, segments=args.segments,
+                                 pens=[name])
+        _, layers = lines.readLines(io.BytesIO(data))
+        strokes = layers[0]
+        penclass = pens.PEN_MAPPING[code]
+        pen = penclass(vector=True, layer=None, color=(0, 0, 0))
+
+        def paint():
+            pdf = canvas.Canvas(io.BytesIO(), (PDFWIDTH, PDFHEIGHT))
+            for stroke in strokes:
+                pen.paint_stroke(pdf, stroke)
+
+        seconds = best_time(paint, args.repeat)
+        report(f"{penclass.__name__}.paint_stroke", seconds,
+               args.strokes * (args.segments - 1))
+
+def bench_document_page(args, doc_path):
+    from reportlab.pdfgen import canvas
+    from rmrl import document, sources
+    from rmrl.constants import PDFHEIGHT, PDFWIDTH
+
+    source = sources.get_source(doc_path)
+    with source.open('{ID}.content') as f:
+        page_id = json.load(f)['pages'][0]
+    page = document.DocumentPage(source, page_id, 0)
+    segments = page.estimate_complexity().segments
+
+    for vector in (True, False):
+        def draw():
+            pdf = canvas.Canvas(io.BytesIO(), (PDFWIDTH, PDFHEIGHT))
+            page.render_to_painter(pdf, vector, 0.3)
+
+        seconds = best_time(draw, args.repeat)
+        report(f"DocumentPage.render_to_painter{'' if vector else ' (bitmap)'}",
+               seconds, segments)
+
+def draw_pages(doc_path):
+    # Returns the drawn pages of a document as a PDF, as render() makes them
+    from reportlab.pdfgen import canvas
+    from rmrl import document, sources
+    from rmrl.constants import PDFHEIGHT, PDFWIDTH
+
+    source = sources.get_source(doc_path)
+    with source.open('{ID}.content') as f:
+        page_ids = json.load(f)['pages']
+    out = io.BytesIO()
+    pdf = canvas.Canvas(out, (PDFWIDTH, PDFHEIGHT))
+    for i, page_id in enumerate(page_ids):
+        document.DocumentPage(source, page_id, i).render_to_painter(pdf, True, 0.3)
+        pdf.showPage()
+    pdf.save()
+    return out.getvalue()
+
+def bench_merge_pages(args, pdf_path):
+    from pdfrw import PdfReader
+    merge_pages = importlib.import_module('rmrl.render').merge_pages
+
+    base_data = synthetic.make_pdf(10)
+    drawn_data = draw_pages(pdf_path)
+    times = []
+    for _ in range(args.repeat):
+        # merge_pages modifies the base pages, so each run needs new ones
+        base = PdfReader(fdata=base_data)
+        drawn = PdfReader(fdata=drawn_data)
+        start = time.perf_counter()
+        for basepage, rmpage in zip(base.pages, drawn.pages):
+            merge_pages(basepage, rmpage, True, True)
+        times.append(time.perf_counter() - start)
+    report("merge_pages (10 pages)", min(times), None)
+
+def bench_render(args, doc_path, pdf_path):
+    from rmrl import render
+
+    for name, path, pages in (('notebook', doc_path, args.pages),
+                              ('annotated PDF', pdf_path, 10)):
+        seconds = best_time(lambda: render(path).read(), args.repeat)
+        report(f"render ({name})", seconds, pages * args.strokes * (args.segments - 1))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run micro-benchmarks of rmrl.")
+    parser.add_argument('--pages', type=int, default=10, help="Pages in the notebook rendered end to end.")
+    parser.add_argument('--strokes', type=int, default=50, help="Strokes per page.")
+    parser.add_argument('--segments', type=int, default=100, help="Segments per stroke.")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of times to run each benchmark.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        # Use a synthetic template, rather than any installed ones
+        os.environ['XDG_DATA_HOME'] = str(tmpdir)
+        (tmpdir / 'rmrl' / 'templates').mkdir(parents=True)
+        (tmpdir / 'rmrl' / 'templates' / 'Grid.svg').write_text(synthetic.make_template())
+
+        # Pass strings, since render() would take a Path for a Source
+        doc_path = str(tmpdir / 'notebook.zip')
+        synthetic.make_document(doc_path, args.pages, args.strokes, args.segments,
+                                template='Grid')
+        pdf_path = str(tmpdir / 'annotated.zip')
+        synthetic.make_document(pdf_path, strokes=args.strokes, segments=args.segments,
+                                pdf_pages=10)
+
+        print(f"{'Benchmark':<40} {'Time (ms)':>10} {'Segments/s':>12}")
+        bench_read_lines(args)
+        bench_pens(args)
+        bench_document_page(args, doc_path)
+        bench_merge_pages(args, pdf_path)
+        bench_render(args, doc_path, pdf_path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
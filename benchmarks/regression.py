@@ -0,0 +1,159 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import datetime
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+
+import synthetic
+from rmrl.constants import CACHE_PATH
+
+__doc__ = """
+Track the time, memory, and output size of rendering typical documents.
+
+A fixed corpus of synthetic documents is rendered, each in a fresh
+interpreter, so that its peak resident memory can be measured.  The results
+are appended to a JSON history file.  If a baseline file is given, this
+fails if any document got slower, used more memory, or produced a larger
+PDF than the baseline allows.  Use --save-baseline to record a new one.
+"""
+
+# Name: arguments to synthetic.make_document
+CORPUS = {
+    'blank-notebook': dict(pages=10, annotate_every=0, template='Grid'),
+    'dense-notebook': dict(pages=5, strokes=400, segments=150, template='Grid'),
+    'annotated-1000-page-pdf': dict(pdf_pages=1000, annotate_every=50, strokes=20),
+    'rotated-pdf': dict(pdf_pages=10, pdf_pagesize=(792, 612), pdf_rotate=90),
+}
+METRICS = ['wall', 'peak_rss', 'output_bytes']
+
+SCRIPT = """
+import resource, sys, time
+start = time.perf_counter()
+from rmrl import render
+stream = render(sys.argv[1])
+stream.seek(0, 2)
+output_bytes = stream.tell()
+wall = time.perf_counter() - start
+# ru_maxrss is in kilobytes on Linux, but bytes on macOS
+scale = 1 if sys.platform == 'darwin' else 1024
+print(wall, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale, output_bytes)
+"""
+
+def make_corpus(corpus_dir):
+    # Returns the path to each document, writing those that don't exist
+    corpus_dir = Path(corpus_dir)
+    template_dir = corpus_dir / 'rmrl' / 'templates'
+    template_dir.mkdir(parents=True, exist_ok=True)
+    (template_dir / 'Grid.svg').write_text(synthetic.make_template())
+    paths = {}
+    for name, kw in CORPUS.items():
+        paths[name] = corpus_dir / f'{name}.zip'
+        if not paths[name].exists():
+            synthetic.make_document(paths[name], **kw)
+    return paths
+
+def measure(path, corpus_dir, runs):
+    # Returns the best wall time and peak RSS, and the output size
+    env = dict(os.environ, XDG_DATA_HOME=str(corpus_dir))
+    results = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-c', SCRIPT, str(path)],
+                                   check=True, capture_output=True, text=True,
+                                   env=env)
+        wall, peak_rss, output_bytes = completed.stdout.split()
+        results.append((float(wall), int(peak_rss), int(output_bytes)))
+    return dict(zip(METRICS, (min(r[i] for r in results) for i in range(3))))
+
+def check(results, baseline, limits):
+    # Returns a list of the regressions beyond the limits
+    failures = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, limit in limits.items():
+            old, new = baseline[name][metric], metrics[metric]
+            if old and new > old * limit:
+                failures.append(f"{name}: {metric} went from {old:,.3f} to "
+                                f"{new:,.3f} ({new / old:.2f}x, limit {limit:.2f}x)")
+    return failures
+
+def load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+def write_json(path, value):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(value, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check rendering of a fixed corpus for performance regressions.")
+    parser.add_argument('--runs', type=int, default=3, help="Number of times to render each document.  The best is kept.")
+    parser.add_argument('--corpus-dir', help="Directory to keep the generated documents in, to save regenerating them.  Defaults to a temporary directory.")
+    parser.add_argument('--history', default=str(CACHE_PATH / 'benchmark-history.json'), help="JSON file to append the results to.  Defaults to one in rmrl's cache directory.")
+    parser.add_argument('--baseline', help="JSON file of results to compare against.")
+    parser.add_argument('--save-baseline', action='store_true', help="Write these results to the baseline file, rather than comparing.")
+    parser.add_argument('--max-time-ratio', type=float, default=1.25, help="Fail if a render takes this much longer than the baseline.")
+    parser.add_argument('--max-rss-ratio', type=float, default=1.2, help="Fail if peak memory is this much more than the baseline.")
+    parser.add_argument('--max-size-ratio', type=float, default=1.05, help="Fail if an output is this much larger than the baseline.")
+    parser.add_argument('--only', action='append', choices=list(CORPUS), help="Render only this document.  May be repeated.")
+    args = parser.parse_args()
+    if args.save_baseline and not args.baseline:
+        parser.error("--save-baseline needs --baseline")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        corpus_dir = Path(args.corpus_dir or tmpdir).resolve()
+        paths = make_corpus(corpus_dir)
+        results = {}
+        print(f"{'Document':<24} {'Wall (s)':>9} {'Peak RSS (MB)':>14} {'Output (KB)':>12}")
+        for name in args.only or CORPUS:
+            results[name] = measure(paths[name], corpus_dir, args.runs)
+            print(f"{name:<24} {results[name]['wall']:>9.2f} "
+                  f"{results[name]['peak_rss'] / 1024**2:>14.1f} "
+                  f"{results[name]['output_bytes'] / 1024:>12.1f}")
+
+    history = load_json(args.history, [])
+    history.append({'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'results': results})
+    write_json(args.history, history)
+
+    if args.save_baseline:
+        write_json(args.baseline, results)
+        print(f"Saved baseline to {args.baseline}")
+    elif args.baseline:
+        failures = check(results, load_json(args.baseline, {}), {
+            'wall': args.max_time_ratio,
+            'peak_rss': args.max_rss_ratio,
+            'output_bytes': args.max_size_ratio})
+        for failure in failures:
+            print(failure)
+        if failures:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
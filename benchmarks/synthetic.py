@@ -0,0 +1,232 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import io
+import json
+import math
+import random
+import sys
+import uuid
+import zipfile
+
+from rmrl import lines
+from rmrl.constants import DISPLAY
+
+__doc__ = """
+Generate synthetic reMarkable documents, for benchmarking.
+
+The strokes are random walks, which exercise the same code as real
+handwriting.  Everything is derived from the seed, so the same arguments
+always give the same document.
+"""
+
+# Pen codes, as found in rmrl.pens.PEN_MAPPING
+PENS = {
+    'paintbrush': 12,
+    'pencil': 14,
+    'ballpoint': 15,
+    'marker': 16,
+    'fineliner': 17,
+    'highlighter': 18,
+    'eraser': 6,
+    'mechanicalpencil': 13,
+    'calligraphy': 21,
+}
+DEFAULT_PENS = ['ballpoint', 'fineliner', 'pencil', 'mechanicalpencil',
+                'marker', 'paintbrush', 'highlighter', 'calligraphy']
+# Color codes, as in rmrl.document.COLORS, weighted towards black
+DEFAULT_COLORS = (0, 0, 0, 1, 2)
+
+def make_rm(version=5, layers=1, strokes=50, segments=100, pens=DEFAULT_PENS,
+            colors=DEFAULT_COLORS, seed=0):
+    # Returns the contents of a .rm file
+    rng = random.Random(seed)
+    out = io.BytesIO()
+    header = lines.HEADER_START + str(version).encode()
+    out.write(header.ljust(lines.S_HEADER_PAGE.size, b' '))
+    if version == 6:
+        write_scene(out, rng, layers, strokes, segments, pens, colors)
+        return out.getvalue()
+    out.write(lines.S_PAGE.pack(layers, 0, 0))
+    for _ in range(layers):
+        out.write(lines.S_LAYER.pack(strokes))
+        for _ in range(strokes):
+            pen = PENS[rng.choice(pens)]
+            color = rng.choice(colors)
+            width = rng.choice((1.875, 2.0, 2.125))
+            if version == 3:
+                out.write(lines.S_STROKE_V3.pack(pen, color, 0, width, segments))
+            else:
+                out.write(lines.S_STROKE_V5.pack(pen, color, 0, width, 0, segments))
+            write_segments(out, rng, segments)
+    return out.getvalue()
+
+def write_scene(out, rng, layers, strokes, segments, pens, colors):
+    # The blocks of a version 6 file: a group item under the root for each
+    # layer, and a line item in the layer for each stroke.  The strokes
+    # are the same as in a version 5 file from the same rng.
+    counter = iter(range(100, 1 << 30))
+    previous_layer = (0, 0)
+    for _ in range(layers):
+        layer_id = (0, next(counter))
+        out.write(scene_item(lines.BLOCK_GROUP_ITEM, lines.ROOT_ID, layer_id,
+                             previous_layer, 2, tagged_id(2, layer_id)))
+        previous_layer = layer_id
+        previous_line = (0, 0)
+        for _ in range(strokes):
+            pen = PENS[rng.choice(pens)]
+            color = rng.choice(colors)
+            thickness = rng.choice((1.875, 2.0, 2.125))
+            points = io.BytesIO()
+            write_segments(points, rng, segments, x_offset=-lines.V6_X_OFFSET)
+            value = (tag(1, lines.TAG_BYTE4) + lines.S_UINT32.pack(pen)
+                     + tag(2, lines.TAG_BYTE4) + lines.S_UINT32.pack(color)
+                     + tag(3, lines.TAG_BYTE8) + lines.S_DOUBLE.pack(thickness / 2)
+                     + tag(4, lines.TAG_BYTE4) + lines.S_FLOAT.pack(0)
+                     + subblock(5, points.getvalue()))
+            line_id = (1, next(counter))
+            out.write(scene_item(lines.BLOCK_LINE_ITEM, layer_id, line_id,
+                                 previous_line, 3, value))
+            previous_line = line_id
+
+def varuint(value):
+    result = bytearray()
+    while value > 0x7F:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+def tag(index, tag_type):
+    return varuint(index << 4 | tag_type)
+
+def tagged_id(index, node_id):
+    return tag(index, lines.TAG_ID) + lines.S_UINT8.pack(node_id[0]) + varuint(node_id[1])
+
+def subblock(index, data):
+    return tag(index, lines.TAG_LENGTH4) + lines.S_UINT32.pack(len(data)) + data
+
+def scene_item(block_type, parent_id, item_id, left_id, item_type, value):
+    # A block holding an item in a group's sequence, with its value.  Items
+    # only give their left neighbour, which is enough to put them in order.
+    data = (tagged_id(1, parent_id) + tagged_id(2, item_id)
+            + tagged_id(3, left_id) + tagged_id(4, (0, 0))
+            + tag(5, lines.TAG_BYTE4) + lines.S_UINT32.pack(0)
+            + subblock(6, bytes([item_type]) + value))
+    return lines.S_BLOCK_HEADER.pack(len(data), 0, 1, 1, block_type) + data
+
+def write_segments(out, rng, segments, x_offset=0):
+    x = rng.uniform(100, DISPLAY['screenwidth'] - 100)
+    y = rng.uniform(100, DISPLAY['screenheight'] - 100)
+    direction = rng.uniform(0, 2 * math.pi)
+    for _ in range(segments):
+        direction += rng.gauss(0, 0.3)
+        x = min(max(x + 3 * math.cos(direction), 0), DISPLAY['screenwidth'])
+        y = min(max(y + 3 * math.sin(direction), 0), DISPLAY['screenheight'])
+        out.write(lines.S_SEGMENT.pack(x + x_offset, y, rng.uniform(0, 40), direction,
+                                       rng.uniform(1.5, 3.5), rng.uniform(0.2, 1)))
+
+def make_pdf(pages, pagesize=(612, 792), rotate=0, text_lines=40):
+    # Returns the contents of a PDF file with some text on each page
+    from reportlab.pdfgen import canvas
+
+    out = io.BytesIO()
+    pdf = canvas.Canvas(out, pagesize, invariant=True)
+    for i in range(pages):
+        if rotate:
+            pdf.setPageRotation(rotate)
+        for j in range(text_lines):
+            pdf.drawString(50, pagesize[1] - 50 - 14 * j,
+                           f"Page {i + 1}, line {j + 1}: the quick brown fox jumps over the lazy dog.")
+        pdf.showPage()
+    pdf.save()
+    return out.getvalue()
+
+def make_template(columns=20, rows=27):
+    # Returns an SVG grid, like the device's templates
+    width, height = DISPLAY['screenwidth'], DISPLAY['screenheight']
+    paths = [f'<line x1="{width * i / columns:.1f}" y1="0" x2="{width * i / columns:.1f}" y2="{height}"/>'
+             for i in range(1, columns)]
+    paths += [f'<line x1="0" y1="{height * i / rows:.1f}" x2="{width}" y2="{height * i / rows:.1f}"/>'
+              for i in range(1, rows)]
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">'
+            f'<g stroke="#000" stroke-width="2">{"".join(paths)}</g></svg>')
+
+def make_document(path, pages=10, strokes=50, segments=100, version=5,
+                  layers=1, pens=DEFAULT_PENS, colors=DEFAULT_COLORS,
+                  annotate_every=1, template=None,
+                  pdf_pages=0, pdf_pagesize=(612, 792), pdf_rotate=0, seed=0):
+    """
+    Write a document zip file to path, as provided by the Cloud API.
+
+    Every annotate_every-th page gets a .rm file with the given number of
+    layers, strokes per layer, and segments per stroke.  template is the
+    name to use for each page's template; it must exist in the template
+    directory to be drawn.  If pdf_pages is not zero, the document gets a
+    base PDF with that many pages, of the given size and rotation, and
+    pages is ignored.
+
+    Returns the document ID.
+    """
+    rng = random.Random(seed)
+    doc_id = str(uuid.UUID(int=rng.getrandbits(128)))
+    if pdf_pages:
+        pages = pdf_pages
+    page_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(pages)]
+    content = {'fileType': 'pdf' if pdf_pages else 'notebook',
+               'pageCount': pages, 'pages': page_ids}
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f'{doc_id}.content', json.dumps(content))
+        zf.writestr(f'{doc_id}.pagedata', '\n'.join([template or 'Blank'] * pages))
+        if pdf_pages:
+            zf.writestr(f'{doc_id}.pdf', make_pdf(pdf_pages, pdf_pagesize, pdf_rotate))
+        for i, page_id in enumerate(page_ids):
+            if annotate_every and i % annotate_every == 0:
+                zf.writestr(f'{doc_id}/{page_id}.rm',
+                            make_rm(version, layers, strokes, segments, pens,
+                                    colors, seed=rng.getrandbits(32)))
+                zf.writestr(f'{doc_id}/{page_id}-metadata.json', json.dumps(
+                    {'layers': [{'name': f'Layer {j + 1}'} for j in range(layers)]}))
+    return doc_id
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic reMarkable document zip file.")
+    parser.add_argument('output', help="Filename of zip file to write.")
+    parser.add_argument('--pages', type=int, default=10, help="Number of pages in a notebook.")
+    parser.add_argument('--strokes', type=int, default=50, help="Strokes per layer on each annotated page.")
+    parser.add_argument('--segments', type=int, default=100, help="Segments per stroke.")
+    parser.add_argument('--layers', type=int, default=1, help="Layers on each annotated page.")
+    parser.add_argument('--version', type=int, choices=(3, 5, 6), default=5, help=".rm file format version.")
+    parser.add_argument('--pens', default=','.join(DEFAULT_PENS), help=f"Comma-separated pens to choose from, out of {', '.join(PENS)}.")
+    parser.add_argument('--annotate-every', type=int, default=1, help="Annotate every Nth page.  0 for none.")
+    parser.add_argument('--template', help="Template name for each page.")
+    parser.add_argument('--pdf-pages', type=int, default=0, help="Number of pages of a base PDF.  0 for a notebook.")
+    parser.add_argument('--pdf-size', default='612x792', help="Page size of the base PDF in points, as WIDTHxHEIGHT.")
+    parser.add_argument('--pdf-rotate', type=int, default=0, help="Rotation of the base PDF pages.")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed.")
+    args = parser.parse_args()
+
+    make_document(args.output, args.pages, args.strokes, args.segments,
+                  args.version, args.layers, args.pens.split(','),
+                  annotate_every=args.annotate_every, template=args.template,
+                  pdf_pages=args.pdf_pages,
+                  pdf_pagesize=tuple(map(float, args.pdf_size.split('x'))),
+                  pdf_rotate=args.pdf_rotate, seed=args.seed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1 +1,4 @@
-from .render import render
+from .region import render_region
+from .render import BudgetExceeded, render, render_async, render_to
+from .svg import render_svg_to, svg_pages
+from .thumbnail import render_thumbnail
@@ -14,39 +14,48 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
-import io
+import importlib
 import sys
-import zipfile
 
-from . import render
-from .constants import VERSION
-from .sources import ZipSource
+from . import render_to
+from .cli import VersionAction, add_render_arguments, render_options
 
-def main():
-    parser = argparse.ArgumentParser(description="Render a PDF file from a Remarkable document.")
+# Subcommands, which are run by the main() of the named module
+COMMANDS = {
+    'batch': 'rmrl.batch',
+    'serve': 'rmrl.serve',
+    'svg': 'rmrl.svg',
+    'thumbnail': 'rmrl.thumbnail',
+    'watch': 'rmrl.watch',
+}
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        return importlib.import_module(COMMANDS[argv[0]]).main(argv[1:])
+
+    parser = argparse.ArgumentParser(description="Render a PDF file from a Remarkable document.",
+        epilog=f"Other commands are available as {', '.join(COMMANDS)}.  Run 'python -m rmrl COMMAND -h' for details.")
     parser.add_argument('input', help="Filename of zip file, or root-level unpacked file of document.  Use '-' to read zip file from stdin.")
     parser.add_argument('output', nargs='?', default='', help="Filename where PDF file should be written.  Omit to write to stdout.")
-    parser.add_argument('--alpha', default=0.3, help="Opacity for template background (0 for no background).")
-    parser.add_argument('--no-expand', action='store_true', help="Don't expand pages to margins on device.")
-    parser.add_argument('--only-annotated', action='store_true', help="Only render pages with annotations.")
-    parser.add_argument('--version', action='version', version=VERSION)
-    args = parser.parse_args()
+    add_render_arguments(parser)
+    parser.add_argument('--profile', metavar='FILE', help="Write cProfile statistics to FILE, and a table of the time taken by each stage and page to stderr.")
+    parser.add_argument('--trace-memory', action='store_true', help="Report the peak memory used in each stage, and the largest allocations, to stderr.")
+    parser.add_argument('--version', action=VersionAction)
+    args = parser.parse_args(argv)
 
     source = args.input
     if source == '-':
-        # zipfile needs to seek, so we need to read this all in
-        source = ZipSource(zipfile.ZipFile(io.BytesIO(sys.stdin.buffer.read())))
-    if args.output:
-        fout = open(args.output, 'wb')
+        source = sys.stdin.buffer
+    dest = args.output or sys.stdout.buffer
+
+    if args.profile or args.trace_memory:
+        from .profiling import profile_render
+        profile_render(source, dest, render_options(args), args.profile,
+                       args.trace_memory, sys.stderr)
     else:
-        fout = sys.stdout.buffer
-
-    stream = render(source,
-                    template_alpha=float(args.alpha),
-                    expand_pages=not args.no_expand,
-                    only_annotated=args.only_annotated)
-    fout.write(stream.read())
-    fout.close()
+        render_to(source, dest, **render_options(args))
     return 0
 
 if __name__ == '__main__':
@@ -0,0 +1,145 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import json
+import logging
+from pathlib import Path
+import sys
+import time
+
+from .cli import add_render_arguments, render_options
+from .sources import LibrarySource
+
+
+log = logging.getLogger(__name__)
+
+# A document to be rendered.  source is a path that render() accepts.
+BatchDocument = namedtuple('BatchDocument', ['name', 'source', 'mtime'])
+
+def find_documents(paths):
+    # Yield a BatchDocument for each zip file or unpacked document found
+    # in paths.  Directories are searched for both, but not recursively,
+    # which covers a xochitl data directory or a folder of zip files.
+    # Unpacked documents in a directory are found through its cached
+    # LibrarySource index, whose mtime is the latest of all the files of
+    # each document, as for unpacked_document().
+    for path in map(Path, paths):
+        if path.is_dir():
+            for zip_path in sorted(path.glob('*.zip')):
+                yield zip_document(zip_path)
+            for entry in LibrarySource(path).documents():
+                yield BatchDocument(entry.id, str(path / f'{entry.id}.content'),
+                                    entry.mtime)
+        elif path.suffix == '.zip':
+            yield zip_document(path)
+        elif path.with_suffix('.content').is_file():
+            content_path = path.with_suffix('.content')
+            if is_document(content_path):
+                yield unpacked_document(content_path)
+        else:
+            log.error(f"Could not find a document at {path}")
+
+def zip_document(path):
+    return BatchDocument(path.stem, str(path), path.stat().st_mtime)
+
+def unpacked_document(content_path):
+    # The document is spread over files next to the .content file, and the
+    # page files in a directory named by the ID.
+    doc_id = content_path.stem
+    base_dir = content_path.parent
+    files = list(base_dir.glob(f'{doc_id}.*'))
+    if (base_dir / doc_id).is_dir():
+        files.extend((base_dir / doc_id).iterdir())
+    mtime = max(f.stat().st_mtime for f in files)
+    return BatchDocument(doc_id, str(content_path), mtime)
+
+def is_document(content_path):
+    # Skip folders and deleted documents in a xochitl directory
+    metadata_path = content_path.with_suffix('.metadata')
+    if not metadata_path.is_file():
+        return True
+    with metadata_path.open('r') as f:
+        metadata = json.load(f)
+    return (metadata.get('type', 'DocumentType') == 'DocumentType'
+            and not metadata.get('deleted', False))
+
+def is_current(doc, output_path):
+    return output_path.exists() and output_path.stat().st_mtime >= doc.mtime
+
+def render_document(doc, output_path, options):
+    # Render one document to output_path, returning the bytes written.
+    # This runs in the worker processes, which keep their caches, such as
+    # parsed templates, from one document to the next.
+    from . import render_to
+
+    return render_to(doc.source, output_path, **options)
+
+def render_batch(docs, output_dir, options, jobs=None, force=False):
+    # Render docs into output_dir, using a pool of jobs processes.  Returns
+    # the counts of documents rendered, skipped, and failed, and the total
+    # bytes written.
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rendered = skipped = failed = nbytes = 0
+
+    todo = []
+    for doc in docs:
+        output_path = output_dir / f'{doc.name}.pdf'
+        if not force and is_current(doc, output_path):
+            skipped += 1
+        else:
+            todo.append((doc, output_path))
+
+    with ProcessPoolExecutor(jobs) as executor:
+        futures = [(doc, executor.submit(render_document, doc, output_path, options))
+                   for doc, output_path in todo]
+        for doc, future in futures:
+            try:
+                nbytes += future.result()
+                rendered += 1
+            except Exception as e:
+                log.error(f"Failed to render {doc.source}: {e}")
+                failed += 1
+
+    return rendered, skipped, failed, nbytes
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m rmrl batch',
+        description="Render many Remarkable documents to PDF files.")
+    parser.add_argument('input', nargs='+', help="Zip files, root-level unpacked files of documents, or directories holding either, such as a xochitl data directory.")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory where PDF files should be written.")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes.  Defaults to the number of CPUs.")
+    parser.add_argument('--force', action='store_true', help="Render documents even if their PDF file is up to date.")
+    add_render_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(message)s')
+    start = time.perf_counter()
+    rendered, skipped, failed, nbytes = render_batch(
+        find_documents(args.input), args.output_dir, render_options(args),
+        jobs=args.jobs, force=args.force)
+    elapsed = time.perf_counter() - start
+
+    print(f"Rendered {rendered} documents in {elapsed:.1f} s "
+          f"({rendered / elapsed:.1f} documents/s, "
+          f"{nbytes / elapsed / 1024**2:.1f} MB/s); "
+          f"{skipped} up to date, {failed} failed")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
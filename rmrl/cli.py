@@ -0,0 +1,50 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+
+from .constants import COMPRESSION_LEVEL
+
+__doc__ = """
+Command-line arguments shared by the rmrl commands.
+"""
+
+class VersionAction(argparse.Action):
+    # Like action='version', but only looks up the version if asked
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS,
+                 default=argparse.SUPPRESS, help="show program's version number and exit"):
+        super().__init__(option_strings=option_strings, dest=dest,
+                         default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from .constants import VERSION
+        parser.exit(message=f'{VERSION}\n')
+
+def add_render_arguments(parser):
+    parser.add_argument('--alpha', default=0.3, help="Opacity for template background (0 for no background).")
+    parser.add_argument('--no-expand', action='store_true', help="Don't expand pages to margins on device.")
+    parser.add_argument('--only-annotated', action='store_true', help="Only render pages with annotations.")
+    parser.add_argument('--compact', action='store_true', help="Write a smaller PDF 1.5 file, using object streams.")
+    parser.add_argument('--deterministic', action='store_true', help="Always give the same output for the same document and options.")
+    parser.add_argument('--compression-level', type=int, default=COMPRESSION_LEVEL, choices=range(10), metavar='0-9', help="zlib compression level for the output.")
+
+def render_options(args):
+    return dict(template_alpha=float(args.alpha),
+                expand_pages=not args.no_expand,
+                only_annotated=args.only_annotated,
+                compact=args.compact,
+                compression_level=args.compression_level,
+                deterministic=args.deterministic)
@@ -1,7 +1,6 @@
 from pathlib import Path
-import pkg_resources
 
-from xdg import xdg_data_home
+from xdg import xdg_cache_home, xdg_data_home
 
 # From rcu.py, with comment
 # Todo: this should be based on the specific RM model
@@ -19,7 +18,26 @@ PDFWIDTH = DISPLAY['screenwidth'] * PTPERPX
 
 SPOOL_MAX = 10 * 1024 * 1024
 
+# Number of pages whose files are read ahead of the one being drawn
+PREFETCH_PAGES = 4
+
+# zlib compression level for the streams of the output
+COMPRESSION_LEVEL = 6
+
 # TODO: parameterize
 TEMPLATE_PATH = xdg_data_home() / 'rmrl' / 'templates'
+CACHE_PATH = xdg_cache_home() / 'rmrl'
 
-VERSION = pkg_resources.get_distribution('rmrl').version
+def __getattr__(name):
+    # Looking up the version is slow, so only do it when asked
+    if name == 'VERSION':
+        global VERSION
+        try:
+            from importlib.metadata import version
+        except ImportError:  # Python 3.7
+            from pkg_resources import get_distribution
+            VERSION = get_distribution('rmrl').version
+        else:
+            VERSION = version('rmrl')
+        return VERSION
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
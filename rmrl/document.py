@@ -14,19 +14,109 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import gc
+from collections import namedtuple
+from functools import lru_cache
+import hashlib
 import json
 import logging
-
-from reportlab.graphics import renderPDF
-from svglib.svglib import svg2rlg
+import threading
 
 from . import lines, pens
+from .stats import stage
 from .constants import DISPLAY, PDFHEIGHT, PDFWIDTH, PTPERPX, TEMPLATE_PATH
 
 
 log = logging.getLogger(__name__)
 
+# Average size of an operator, with its operands, in the content stream
+BYTES_PER_OPERATOR = 12
+
+class PageComplexity(namedtuple('PageComplexity',
+                                ['segments', 'operators', 'stream_bytes'],
+                                defaults=(None, None, None))):
+    # The estimated cost of drawing a page as vectors.  This also serves
+    # as a budget for that cost, in which case None means no limit.
+    __slots__ = ()
+
+    def exceeds(self, budget):
+        return any(limit is not None and value > limit
+                   for value, limit in zip(self, budget))
+
+
+# reportlab marks up the nodes of a drawing as it draws them, so a cached
+# template may only be drawn by one thread at a time.
+TEMPLATE_LOCK = threading.Lock()
+
+@lru_cache(maxsize=16)
+def load_template(template_path):
+    # Parsing the SVG is slow, and a few templates get used over and over,
+    # so keep them around.  The drawing is scaled to the page width.
+    from svglib.svglib import svg2rlg
+
+    background = svg2rlg(template_path)
+    background.scale(PDFWIDTH / background.width, PDFWIDTH / background.width)
+    return background
+
+# Ink colors, by the color code of a stroke
+COLORS = [
+    #QSettings().value('pane/notebooks/export_pdf_blackink'),
+    #QSettings().value('pane/notebooks/export_pdf_grayink'),
+    #QSettings().value('pane/notebooks/export_pdf_whiteink')
+    (0, 0, 0),
+    (0.5, 0.5, 0.5),
+    (1, 1, 1),
+    # Added in version 6 files
+    (0.98, 0.97, 0.1),   # Yellow
+    (0, 0.7, 0),         # Green
+    (1, 0.75, 0.8),      # Pink
+    (0.31, 0.41, 0.79),  # Blue
+    (0.7, 0.24, 0.22),   # Red
+    (0.49, 0.49, 0.49),  # Gray overlap
+    (0.98, 0.97, 0.1),   # Highlight
+    (0.63, 0.85, 0.49),  # Green
+    (0.55, 0.82, 0.9),   # Cyan
+    (0.72, 0.51, 0.8),   # Magenta
+    (0.97, 0.91, 0.32),  # Yellow
+]
+
+def page_template(source, pagenum):
+    # The path of the template of a page, or None for a blank page
+    template_names = []
+    pagedatapath = '{ID}.pagedata'
+    if source.exists(pagedatapath):
+        with source.open(pagedatapath, 'r') as f:
+            template_names = f.read().splitlines()
+
+    if template_names:
+        # I have encountered an issue with some PDF files, where the
+        # rM won't save the page template for later pages. In this
+        # case, just take the last-available page template, which
+        # is usually 'Blank'.
+        template_name = template_names[max(pagenum, len(template_names) - 1)]
+        template_path = TEMPLATE_PATH / f'{template_name}.svg'
+        if template_name != 'Blank' and template_path.exists():
+            return str(template_path)
+    return None
+
+def page_rmpath(source, pid, pagenum):
+    # The name of the .rm file of a page, which may not exist.  On disk,
+    # these files are named by a UUID, but from the API they are just
+    # numbered.
+    rmpath = f'{{ID}}/{pid}.rm'
+    if not source.exists(rmpath):
+        rmpath = f'{{ID}}/{pagenum}.rm'
+    return rmpath
+
+def stroke_bounds(stroke):
+    # The box around a stroke, padded by its width, which is more than
+    # any pen draws outside of its points
+    if not stroke.segments:
+        return (0, 0, -1, -1)
+    pad = max([stroke.width] + [segment.width for segment in stroke.segments])
+    xs = [segment.x for segment in stroke.segments]
+    ys = [segment.y for segment in stroke.segments]
+    return (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad)
+
 class DocumentPage:
     # A single page in a document
     def __init__(self, source, pid, pagenum):
@@ -34,37 +124,17 @@ class DocumentPage:
         self.source = source
         self.num = pagenum
 
-        # On disk, these files are named by a UUID
-        self.rmpath = f'{{ID}}/{pid}.rm'
-        if not source.exists(self.rmpath):
-            # From the API, these files are just numbered
-            pid = str(pagenum)
-            self.rmpath = f'{{ID}}/{pid}.rm'
+        self.rmpath = page_rmpath(source, pid, pagenum)
 
-        # Try to load page metadata
+        # Try to load page metadata, which is named like the .rm file
         self.metadict = None
-        metafilepath = f'{{ID}}/{pid}-metadata.json'
+        metafilepath = self.rmpath[:-len('.rm')] + '-metadata.json'
         if source.exists(metafilepath):
             with source.open(metafilepath, 'r') as f:
                 self.metadict = json.load(f)
 
         # Try to load template
-        self.template = None
-        template_names = []
-        pagedatapath = '{ID}.pagedata'
-        if source.exists(pagedatapath):
-            with source.open(pagedatapath, 'r') as f:
-                template_names = f.read().splitlines()
-
-        if template_names:
-            # I have encountered an issue with some PDF files, where the
-            # rM won't save the page template for later pages. In this
-            # case, just take the last-available page template, which
-            # is usually 'Blank'.
-            template_name = template_names[max(self.num, len(template_names) - 1)]
-            template_path = TEMPLATE_PATH / f'{template_name}.svg'
-            if template_name != 'Blank' and template_path.exists():
-                self.template = str(template_path)
+        self.template = page_template(source, self.num)
 
         # Load layers
         self.layers = []
@@ -82,6 +152,31 @@ class DocumentPage:
             annotations.append(layer.get_grouped_annotations())
         return annotations
 
+    def estimate_complexity(self):
+        # A cheap pass over the strokes, without drawing anything
+        segments = operators = 0
+        for layer in self.layers:
+            for stroke in layer.strokes:
+                penclass = pens.PEN_MAPPING.get(stroke.pen) or pens.GenericPen
+                n_segments = max(len(stroke.segments) - 1, 0)
+                segments += n_segments
+                operators += penclass.STROKE_OPS + n_segments * penclass.SEGMENT_OPS
+        return PageComplexity(segments, operators,
+                              operators * BYTES_PER_OPERATOR)
+
+    def cull_strokes(self, bbox):
+        # Drop the strokes that don't reach into bbox, given as (left, top,
+        # right, bottom) in device pixels
+        left, top, right, bottom = bbox
+        for layer in self.layers:
+            kept = []
+            for stroke in layer.strokes:
+                s_left, s_top, s_right, s_bottom = stroke_bounds(stroke)
+                if (s_left <= right and s_right >= left
+                        and s_top <= bottom and s_bottom >= top):
+                    kept.append(stroke)
+            layer.strokes = kept
+
     def load_layers(self):
         # Loads layers from the .rm files
 
@@ -107,19 +202,32 @@ class DocumentPage:
             layer.strokes = layerstrokes
             self.layers.append(layer)
 
-    def render_to_painter(self, canvas, vector, template_alpha):
+    def render_to_painter(self, canvas, vector, template_alpha, stats=None):
         # Render template layer
         if self.template:
             if template_alpha > 0:
-                background = svg2rlg(self.template)
-                background.scale(PDFWIDTH / background.width, PDFWIDTH / background.width)
-                renderPDF.draw(background, canvas, 0, 0)
-                if template_alpha < 1:
-                    canvas.saveState()
-                    canvas.setFillColorRGB(1., 1., 1.)
-                    canvas.setFillAlpha(1 - template_alpha)
-                    canvas.rect(0, 0, PDFWIDTH, PDFHEIGHT, fill=True, stroke=False)
-                    canvas.restoreState()
+                # Slow to import, and only needed for templates
+                from reportlab.graphics import renderPDF
+
+                with stage(stats, 'template', self.num):
+                    # Each template is drawn once, as a form XObject that
+                    # all the pages using it refer to.
+                    name = 'Template' + hashlib.sha1(self.template.encode()).hexdigest()[:16]
+                    if not canvas.hasForm(name):
+                        canvas.beginForm(name, 0, 0, PDFWIDTH, PDFHEIGHT)
+                        template = load_template(self.template)
+                        with TEMPLATE_LOCK:
+                            renderPDF.draw(template, canvas, 0, 0)
+                        canvas.endForm()
+                    canvas.doForm(name)
+                    # The form's resources don't get the alpha state, so
+                    # the overlay goes on the page itself.
+                    if template_alpha < 1:
+                        canvas.saveState()
+                        canvas.setFillColorRGB(1., 1., 1.)
+                        canvas.setFillAlpha(1 - template_alpha)
+                        canvas.rect(0, 0, PDFWIDTH, PDFHEIGHT, fill=True, stroke=False)
+                        canvas.restoreState()
             # Bitmaps are rendered into the PDF as XObjects, which are
             # easy to pick out for layers. Vectors will render
             # everything inline, and so we need to add a 'magic point'
@@ -136,34 +244,27 @@ class DocumentPage:
         canvas.translate(0, PDFHEIGHT)
         canvas.scale(PTPERPX, -PTPERPX)
         # Render user layers
-        for layer in self.layers:
-            # Bitmaps are rendered into the PDF as XObjects, which are
-            # easy to pick out for layers. Vectors will render
-            # everything inline, and so we need to add a 'magic point'
-            # to mark the beginning of layers.
-            if False and vector:  #TODO
-                pen = GenericPen(color=Qt.transparent, vector=vector)
-                painter.setPen(pen)
-                painter.drawPoint(420, 69)
-            layer.render_to_painter(canvas, vector)
-        canvas.showPage()
+        with stage(stats, 'draw', self.num):
+            for layer in self.layers:
+                # Bitmaps are rendered into the PDF as XObjects, which are
+                # easy to pick out for layers. Vectors will render
+                # everything inline, and so we need to add a 'magic point'
+                # to mark the beginning of layers.
+                if False and vector:  #TODO
+                    pen = GenericPen(color=Qt.transparent, vector=vector)
+                    painter.setPen(pen)
+                    painter.drawPoint(420, 69)
+                layer.render_to_painter(canvas, vector)
+            canvas.showPage()
 
 
 class DocumentPageLayer:
-    pen_widths = []
 
     def __init__(self, page, name=None):
         self.page = page
         self.name = name
 
-        self.colors = [
-            #QSettings().value('pane/notebooks/export_pdf_blackink'),
-            #QSettings().value('pane/notebooks/export_pdf_grayink'),
-            #QSettings().value('pane/notebooks/export_pdf_whiteink')
-            (0, 0, 0),
-            (0.5, 0.5, 0.5),
-            (1, 1, 1)
-        ]
+        self.colors = COLORS
 
         # Set this from the calling func
         self.strokes = None
@@ -233,6 +334,10 @@ class DocumentPageLayer:
                 log.error("Unknown pen code %d" % pen)
                 penclass = pens.GenericPen
 
+            if color >= len(self.colors):
+                log.error("Unknown color code %d" % color)
+                color = 0
+
             qpen = penclass(vector=vector,
                             layer=self,
                             color=self.colors[color])
@@ -245,30 +350,21 @@ class DocumentPageLayer:
             self.paint_strokes(painter, vector=vector)
             return
 
-        assert False
-
-        # I was having problems with QImage corruption (garbage data)
-        # and memory leaking on large notebooks. I fixed this by giving
-        # the QImage a reference array to pre-allocate RAM, then reset
-        # the reference count after I'm done with it, so that it gets
-        # cleaned up by the python garbage collector.
-
-        devpx = DISPLAY['screenwidth'] \
-            * DISPLAY['screenheight']
-        bytepp = 4  # ARGB32
-        qimage = QImage(b'\0' * devpx * bytepp,
-                        DISPLAY['screenwidth'],
-                        DISPLAY['screenheight'],
-                        QImage.Format_ARGB32)
-
-        imgpainter = QPainter(qimage)
-        imgpainter.setRenderHint(QPainter.Antialiasing)
-        #imgpainter.setRenderHint(QPainter.LosslessImageRendering)
-        self.paint_strokes(imgpainter, vector=vector)
-        imgpainter.end()
-
-        painter.drawImage(0, 0, qimage)
-
-        del imgpainter
-        del qimage
-        gc.collect()
+        # Draw the layer into a bitmap at the device resolution, which
+        # goes into the PDF as a single XObject.  This lets the pencils
+        # and paintbrush use their textures.
+        from reportlab.lib.utils import ImageReader
+        from . import raster
+
+        width, height = DISPLAY['screenwidth'], DISPLAY['screenheight']
+        image = raster.RasterCanvas(width, height)
+        self.paint_strokes(image, vector=vector)
+
+        # The painter has y running downwards, so flip it back for the
+        # image to end up the right way up.
+        painter.saveState()
+        painter.translate(0, height)
+        painter.scale(1, -1)
+        painter.drawImage(ImageReader(image.image), 0, 0, width, height,
+                          mask='auto')
+        painter.restoreState()
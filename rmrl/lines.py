@@ -24,9 +24,15 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-from collections import namedtuple
+import array
+from collections import defaultdict, namedtuple
+import heapq
+import math
 import struct
 import json
+import sys
+
+from .constants import DISPLAY
 
 Layer = namedtuple('Layer', ['strokes', 'name'])
 
@@ -38,6 +44,9 @@ Segment = namedtuple(
     'Segment',
     ['x', 'y', 'speed', 'direction', 'width', 'pressure']
 )
+# Just enough of a stroke to draw it roughly.  xs and ys are sequences of
+# the coordinates of the points.
+StrokePoints = namedtuple('StrokePoints', ['pen', 'color', 'width', 'xs', 'ys'])
 
 HEADER_START = b'reMarkable .lines file, version='
 S_HEADER_PAGE = struct.Struct('<{}ss10s'.format(len(HEADER_START)))
@@ -47,6 +56,42 @@ S_STROKE_V3 = struct.Struct('<IIIfI')
 S_STROKE_V5 = struct.Struct('<IIIfII')
 S_SEGMENT = struct.Struct('<ffffff')
 
+# Version 6 files are a stream of blocks, each with a header giving its
+# length, version, and type.  The block contents are tagged values, each
+# preceded by a varuint of (index << 4 | tag type).
+S_BLOCK_HEADER = struct.Struct('<IBBBB')
+S_UINT8 = struct.Struct('<B')
+S_UINT32 = struct.Struct('<I')
+S_FLOAT = struct.Struct('<f')
+S_DOUBLE = struct.Struct('<d')
+# Points in version 2 line blocks pack speed, width, direction, and
+# pressure into integers.
+S_POINT_V1 = S_SEGMENT
+S_POINT_V2 = struct.Struct('<ffHHBB')
+
+BLOCK_TREE_NODE = 0x02
+BLOCK_GROUP_ITEM = 0x04
+BLOCK_LINE_ITEM = 0x05
+BLOCK_TOMBSTONE_ITEM = 0x08
+
+TAG_BYTE1 = 0x1
+TAG_BYTE4 = 0x4
+TAG_BYTE8 = 0x8
+TAG_LENGTH4 = 0xC
+TAG_ID = 0xF
+
+# IDs are (author, counter) pairs.  The root group holds the layers.
+ROOT_ID = (0, 1)
+
+# Version 6 coordinates have x = 0 in the middle of the page
+V6_X_OFFSET = DISPLAY['screenwidth'] / 2
+
+BlockInfo = namedtuple('BlockInfo', ['type', 'version', 'start', 'end'])
+# An entry in the sequence of items in a group.  value_start is the offset
+# of the value, or None for deleted items, whose values are never read.
+SceneItem = namedtuple('SceneItem', ['type', 'parent_id', 'item_id', 'left_id',
+                                     'right_id', 'block', 'value_start'])
+
 
 class UnsupportedVersion(Exception):
     pass
@@ -76,8 +121,10 @@ def readLines(source):
             readStroke = readStroke3
         elif ver == 5:
             readStroke = readStroke5
+        elif ver == 6:
+            return (ver, readLines6(source.read()))
         else:
-            raise UnsupportedVersion("Remy supports notebooks in the version 3 and 5 format only")
+            raise UnsupportedVersion("Remy supports notebooks in the version 3, 5, and 6 format only")
         n_layers, _, _ = readStruct(S_PAGE, source)
         layers = []
         for l in range(n_layers):
@@ -94,5 +141,262 @@ def readLines(source):
 
         return (ver, layers)
 
-    except struct.error:
+    except (struct.error, IndexError):
         raise InvalidFormat("Error while reading page")
+
+def readPoints(source):
+    # Like readLines, but each stroke is a StrokePoints.  In version 3 and
+    # 5 files, the segments of a stroke are read all at once into an
+    # array, without making a Segment for each, which is much faster.
+    try:
+        header, ver, *_ = readStruct(S_HEADER_PAGE, source)
+        if not header.startswith(HEADER_START):
+            raise InvalidFormat("Header is invalid")
+        ver = int(ver)
+        if ver == 6:
+            return (ver, [[StrokePoints(stroke.pen, stroke.color, stroke.width,
+                                        [s.x for s in stroke.segments],
+                                        [s.y for s in stroke.segments])
+                           for stroke in layer]
+                          for layer in readLines6(source.read())])
+        if ver == 3:
+            readStroke = readStroke3
+        elif ver == 5:
+            readStroke = readStroke5
+        else:
+            raise UnsupportedVersion("Remy supports notebooks in the version 3, 5, and 6 format only")
+        n_layers, _, _ = readStruct(S_PAGE, source)
+        layers = []
+        for l in range(n_layers):
+            n_strokes, = readStruct(S_LAYER, source)
+            strokes = []
+            for s in range(n_strokes):
+                pen, color, _, width, _, n_segments = readStroke(source)
+                values = array.array('f')
+                values.frombytes(source.read(n_segments * S_SEGMENT.size))
+                if len(values) != n_segments * 6:
+                    raise InvalidFormat("Error while reading page")
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                # As in readLines, the width of the last segment stands
+                # for the stroke
+                if n_segments:
+                    width = values[-2]
+                strokes.append(StrokePoints(pen, color, width,
+                                            values[0::6], values[1::6]))
+            layers.append(strokes)
+
+        return (ver, layers)
+
+    except (struct.error, IndexError):
+        raise InvalidFormat("Error while reading page")
+
+
+class BlockReader:
+    # Reads tagged values from data, starting at pos
+
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt):
+        value, = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return value
+
+    def read_varuint(self):
+        result = shift = 0
+        while True:
+            byte = self.data[self.pos]
+            self.pos += 1
+            result |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return result
+
+    def has_tag(self, index, tag_type, end):
+        # Whether the next value, before end, has this tag
+        if self.pos >= end:
+            return False
+        pos = self.pos
+        found = self.read_varuint() == (index << 4 | tag_type)
+        self.pos = pos
+        return found
+
+    def read_tag(self, index, tag_type):
+        tag = self.read_varuint()
+        if tag != (index << 4 | tag_type):
+            raise InvalidFormat(f"Expected tag {index}/{tag_type:#x}, found "
+                                f"{tag >> 4}/{tag & 0xF:#x} at {self.pos}")
+
+    def read_id(self, index):
+        self.read_tag(index, TAG_ID)
+        return (self.unpack(S_UINT8), self.read_varuint())
+
+    def read_bool(self, index):
+        self.read_tag(index, TAG_BYTE1)
+        return bool(self.unpack(S_UINT8))
+
+    def read_int(self, index):
+        self.read_tag(index, TAG_BYTE4)
+        return self.unpack(S_UINT32)
+
+    def read_float(self, index):
+        self.read_tag(index, TAG_BYTE4)
+        return self.unpack(S_FLOAT)
+
+    def read_double(self, index):
+        self.read_tag(index, TAG_BYTE8)
+        return self.unpack(S_DOUBLE)
+
+    def read_subblock(self, index):
+        # Returns the end of the subblock, which starts at pos
+        self.read_tag(index, TAG_LENGTH4)
+        length = self.unpack(S_UINT32)
+        return self.pos + length
+
+
+def indexBlocks(data, pos):
+    # A cheap pass over the file, finding the type and extent of each block
+    blocks = []
+    while pos < len(data):
+        length, _, _, version, block_type = S_BLOCK_HEADER.unpack_from(data, pos)
+        pos += S_BLOCK_HEADER.size
+        if pos + length > len(data):
+            raise InvalidFormat("Block runs past the end of the file")
+        blocks.append(BlockInfo(block_type, version, pos, pos + length))
+        pos += length
+    return blocks
+
+def readSceneItem(data, block):
+    # Reads the header of an item in a group's sequence, but not its value
+    reader = BlockReader(data, block.start)
+    parent_id = reader.read_id(1)
+    item_id = reader.read_id(2)
+    left_id = reader.read_id(3)
+    right_id = reader.read_id(4)
+    deleted_length = reader.read_int(5)
+    value_start = None
+    if not deleted_length and reader.has_tag(6, TAG_LENGTH4, block.end):
+        reader.read_subblock(6)
+        reader.pos += 1  # Item type
+        value_start = reader.pos
+    return SceneItem(block.type, parent_id, item_id, left_id, right_id,
+                     block, value_start)
+
+def readVisible(data, block):
+    # Returns the ID of a tree node and whether it is visible.  The label
+    # and visibility are last-writer-wins values, with a timestamp first.
+    reader = BlockReader(data, block.start)
+    node_id = reader.read_id(1)
+    reader.pos = reader.read_subblock(2)
+    reader.read_subblock(3)
+    reader.read_id(1)
+    return node_id, reader.read_bool(2)
+
+def readStroke6(data, item):
+    reader = BlockReader(data, item.value_start)
+    pen = reader.read_int(1)
+    color = reader.read_int(2)
+    reader.read_double(3)  # Thickness scale
+    reader.read_float(4)  # Starting length
+    end = reader.read_subblock(5)
+    points = data[reader.pos:end]
+    if item.block.version == 1:
+        segments = [Segment(x + V6_X_OFFSET, y, speed, direction, width, pressure)
+                    for x, y, speed, direction, width, pressure
+                    in S_POINT_V1.iter_unpack(points)]
+    else:
+        segments = [Segment(x + V6_X_OFFSET, y, speed / 4,
+                            direction * 2 * math.pi / 255, width / 4,
+                            pressure / 255)
+                    for x, y, speed, width, direction, pressure
+                    in S_POINT_V2.iter_unpack(points)]
+    # As in version 3 and 5 files, the width of the last segment, in
+    # device pixels, stands for the stroke
+    width = segments[-1].width if segments else 0
+    return Stroke(pen, color, 0, width, 0, segments)
+
+def sortItems(items):
+    # Items in a sequence give their left and right neighbours, at the time
+    # they were inserted.  Sort them so that each comes after its left
+    # neighbour and before its right one, breaking ties as the device does.
+    by_id = {item.item_id: item for item in items}
+    start, end = 'start', 'end'
+    def side(item_id, default):
+        return item_id if item_id in by_id else default
+
+    waiting = defaultdict(int)
+    following = defaultdict(list)
+    for item in items:
+        left = side(item.left_id, start)
+        right = side(item.right_id, end)
+        waiting[item.item_id] += 1
+        following[left].append(item.item_id)
+        waiting[right] += 1
+        following[item.item_id].append(right)
+
+    def key(node):
+        if node == start:
+            return (0, 0, 0)
+        if node == end:
+            return (2, 0, 0)
+        return (1, -node[0], node[1])
+
+    ready = [(key(node), node) for node in [start] + list(by_id)
+             if not waiting[node]]
+    heapq.heapify(ready)
+    result = []
+    while ready:
+        _, node = heapq.heappop(ready)
+        if node in by_id:
+            result.append(by_id[node])
+        for after in following[node]:
+            waiting[after] -= 1
+            if not waiting[after]:
+                heapq.heappush(ready, (key(after), after))
+    if len(result) < len(by_id):
+        # A cycle, which shouldn't happen.  Keep the file order for the rest.
+        seen = {item.item_id for item in result}
+        result.extend(item for item in items if item.item_id not in seen)
+    return result
+
+def readLines6(data):
+    # Returns the strokes of each layer.  The file is first indexed, and
+    # then only the blocks describing the layers and the line items on
+    # visible layers are decoded.  Deleted items are only read as far as
+    # needed to put the others in order.
+    blocks = indexBlocks(data, 0)
+
+    visible = {}
+    children = defaultdict(list)
+    for block in blocks:
+        if block.type == BLOCK_TREE_NODE:
+            node_id, is_visible = readVisible(data, block)
+            visible[node_id] = is_visible
+        elif block.type in (BLOCK_GROUP_ITEM, BLOCK_LINE_ITEM, BLOCK_TOMBSTONE_ITEM):
+            item = readSceneItem(data, block)
+            children[item.parent_id].append(item)
+
+    def strokes_in(node_id):
+        strokes = []
+        for item in sortItems(children[node_id]):
+            if item.value_start is None:
+                continue
+            if item.type == BLOCK_LINE_ITEM:
+                strokes.append(readStroke6(data, item))
+            elif item.type == BLOCK_GROUP_ITEM:
+                # The value of a group item is the ID of the group
+                child_id = BlockReader(data, item.value_start).read_id(2)
+                if visible.get(child_id, True):
+                    strokes.extend(strokes_in(child_id))
+        return strokes
+
+    layers = []
+    for item in sortItems(children[ROOT_ID]):
+        if item.type != BLOCK_GROUP_ITEM or item.value_start is None:
+            continue
+        layer_id = BlockReader(data, item.value_start).read_id(2)
+        # Keep hidden layers, empty, so the others match their metadata
+        layers.append(strokes_in(layer_id) if visible.get(layer_id, True) else [])
+    return layers
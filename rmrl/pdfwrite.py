@@ -0,0 +1,243 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import zlib
+
+from pdfrw import PdfArray, PdfDict, PdfName
+from pdfrw.pdfwriter import NullObject, user_fmt
+# Much faster than base64.a85decode
+from reportlab.lib.rl_accel import asciiBase85Decode
+
+from .constants import COMPRESSION_LEVEL
+
+__doc__ = """
+Compress the streams of a pdfrw object tree, and write it as a compact
+PDF 1.5 file.
+
+compress_streams() compresses the content streams of the pages, and the
+forms and images they draw, in a pool of threads.  zlib releases the GIL
+while it works, so large documents can use all of the cores.
+
+pdfrw's PdfWriter puts every indirect object at the top level of the file,
+each with its own entry in a plain-text cross-reference table.  Our pages
+are made of many small dictionaries, so much of a file can be this
+overhead.  write_compact() instead packs the objects that aren't streams
+into compressed object streams, and writes the cross-reference table as a
+compressed stream too.
+
+Streams are also tidied up: the ASCII85 encoding that reportlab wraps
+around its compressed streams is removed, and uncompressed streams are
+compressed.  Like PdfWriter, only the objects that can be reached from the
+trailer are written, so anything no longer referenced is dropped.
+"""
+
+# Number of objects packed into each object stream
+OBJECTS_PER_STREAM = 200
+# Trailer entries that describe the file being read, not the one written
+OLD_TRAILER_KEYS = (PdfName.Size, PdfName.Prev, PdfName.XRefStm,
+                    PdfName.Filter, PdfName.DecodeParms, PdfName.Length,
+                    PdfName.Type, PdfName.W, PdfName.Index)
+
+def compress_streams(pages, level=COMPRESSION_LEVEL, workers=None):
+    """
+    Compress the uncompressed streams used by pages with zlib at the given
+    level, in a pool of threads (by default, as many as
+    ThreadPoolExecutor chooses).  Level 0 leaves them alone.
+    """
+    streams = [obj for obj in page_streams(pages)
+               if obj.Filter is None and obj.DecodeParms is None]
+    if not level or not streams:
+        return
+
+    def compress(obj):
+        return zlib.compress(obj.stream.encode('latin-1'), level)
+
+    with ThreadPoolExecutor(workers) as executor:
+        for obj, data in zip(streams, executor.map(compress, streams)):
+            if len(data) < len(obj.stream):
+                obj.stream = data.decode('latin-1')
+                obj.Filter = PdfName.FlateDecode
+
+def page_streams(pages):
+    # The content streams of the pages, and of the XObjects they use
+    seen = set()
+    todo = []
+    for page in pages:
+        contents = page.Contents
+        todo.extend(contents if isinstance(contents, PdfArray) else [contents])
+        todo.append(page.Resources)
+    while todo:
+        obj = todo.pop()
+        if obj is None or id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        if obj.stream is not None:
+            yield obj
+            todo.append(obj.Resources)
+        elif obj.XObject is not None:
+            # A resource dictionary
+            todo.extend(obj.XObject.values())
+
+def write_compact(f, trailer, killobj=None, level=COMPRESSION_LEVEL):
+    """
+    Write the PDF file with the given trailer to the binary file object f.
+
+    killobj is the PdfWriter attribute of the same name, used when the
+    pages have been copied with addpage(): it names the objects of the
+    old page tree, which are replaced by the new ones.  level is the zlib
+    compression level of the object streams, and of any streams left
+    uncompressed.
+    """
+    swap = replacements(trailer, killobj or {})
+    numbers = {}
+    pending = deque()
+    offset = 0
+    # The cross-reference entries, by object number: (1, offset) for
+    # objects at the top level, and (2, stream, index) for those in an
+    # object stream.
+    xref = {}
+    packed = []
+
+    def write(data):
+        nonlocal offset
+        if isinstance(data, str):
+            data = data.encode('latin-1')
+        f.write(data)
+        offset += len(data)
+
+    def reserve():
+        number = len(numbers) + 1
+        numbers[('reserved', number)] = number
+        return number
+
+    def ref(obj):
+        # Returns the reference to an indirect object, or the formatted
+        # value of a direct one.
+        if isinstance(obj, PdfDict):
+            indirect = obj.indirect or obj.stream is not None
+        else:
+            indirect = getattr(obj, 'indirect', False)
+        if not indirect:
+            return fmt(obj)
+        obj = swap.get(id(obj), obj)
+        number = numbers.get(id(obj))
+        if number is None:
+            number = numbers[id(obj)] = len(numbers) + 1
+            pending.append((number, obj))
+        return f'{number} 0 R'
+
+    def fmt(obj):
+        if isinstance(obj, (list, tuple)):
+            return '[' + ' '.join(ref(value) for value in obj) + ']'
+        if isinstance(obj, dict):
+            if not isinstance(obj, PdfDict):
+                obj = PdfDict(obj)
+            items = sorted((getattr(key, 'encoded', None) or key, value)
+                           for key, value in obj.iteritems())
+            return '<<' + ''.join(f'{key} {ref(value)}' for key, value in items) + '>>'
+        if hasattr(obj, 'indirect'):
+            return str(getattr(obj, 'encoded', None) or obj)
+        return user_fmt(obj)
+
+    def write_stream(number, obj):
+        xref[number] = (1, offset, 0)
+        write(f'{number} 0 obj\n{fmt(obj)}\nstream\n')
+        write(obj.stream)
+        write('\nendstream\nendobj\n')
+
+    def flush():
+        # Writes the packed objects as an object stream
+        if not packed:
+            return
+        number = reserve()
+        header, bodies, position = [], [], 0
+        for index, (obj_number, body) in enumerate(packed):
+            xref[obj_number] = (2, number, index)
+            header.append(f'{obj_number} {position}')
+            bodies.append(body)
+            position += len(body) + 1
+        header = ' '.join(header) + '\n'
+        data = zlib.compress((header + '\n'.join(bodies)).encode('latin-1'), level)
+        xref[number] = (1, offset, 0)
+        write(f'{number} 0 obj\n<</Type /ObjStm /N {len(packed)} '
+              f'/First {len(header)} /Filter /FlateDecode /Length {len(data)}>>\nstream\n')
+        write(data)
+        write('\nendstream\nendobj\n')
+        packed.clear()
+
+    write('%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    trailer = PdfDict((key, value) for key, value in trailer.iteritems()
+                      if key not in OLD_TRAILER_KEYS)
+    trailer_entries = fmt(trailer)[2:-2]
+    while pending:
+        number, obj = pending.popleft()
+        if isinstance(obj, PdfDict) and obj.stream is not None:
+            compact_stream(obj, level)
+            write_stream(number, obj)
+        else:
+            packed.append((number, fmt(obj)))
+            if len(packed) == OBJECTS_PER_STREAM:
+                flush()
+    flush()
+
+    number = reserve()
+    xref[number] = (1, offset, 0)
+    size = number + 1
+    width = max(1, (max(offset, size).bit_length() + 7) // 8)
+    rows = [(0, 0, 65535)] + [xref[i] for i in range(1, size)]
+    data = zlib.compress(b''.join(kind.to_bytes(1, 'big') + field.to_bytes(width, 'big')
+                                  + extra.to_bytes(2, 'big')
+                                  for kind, field, extra in rows), level)
+    start = offset
+    write(f'{number} 0 obj\n<<{trailer_entries} /Type /XRef /Size {size} '
+          f'/W [1 {width} 2] /Filter /FlateDecode /Length {len(data)}>>\nstream\n')
+    write(data)
+    write(f'\nendstream\nendobj\nstartxref\n{start}\n%%EOF\n')
+
+def replacements(trailer, killobj):
+    # Maps the id of each object of an old page tree to what should be
+    # written in its place, as PdfWriter does.
+    new_tree = {PdfName.Catalog: trailer.Root, PdfName.Pages: trailer.Root.Pages,
+                None: trailer}
+    swap = {}
+    for objid, (obj, new_obj) in killobj.items():
+        if new_obj is None:
+            new_obj = new_tree.get(obj.Type)
+        swap[objid] = NullObject if new_obj is None else new_obj
+    return swap
+
+def compact_stream(obj, level):
+    # Removes ASCII85 encoding from a stream, and compresses it if it
+    # wasn't already.  pdfrw keeps stream data as latin-1 strings.
+    filters = obj.Filter
+    if obj.DecodeParms is not None:
+        return
+    if not isinstance(filters, PdfArray):
+        filters = [] if filters is None else [filters]
+    if filters and filters[0] == PdfName.ASCII85Decode:
+        data = obj.stream.strip()
+        if not data.endswith('~>'):
+            data += '~>'
+        obj.stream = asciiBase85Decode(data).decode('latin-1')
+        filters = filters[1:]
+    if not filters and level:
+        data = zlib.compress(obj.stream.encode('latin-1'), level)
+        if len(data) < len(obj.stream):
+            obj.stream = data.decode('latin-1')
+            filters = [PdfName.FlateDecode]
+    obj.Filter = (None if not filters else filters[0] if len(filters) == 1
+                  else PdfArray(filters))
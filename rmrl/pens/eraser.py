@@ -17,6 +17,9 @@
 from .generic import GenericPen
 
 class EraserPen(GenericPen):
+    STROKE_OPS = 0
+    SEGMENT_OPS = 0
+
     def paint_stroke(self, canvas, stroke):
         # Don't actually paint anything
         pass
@@ -22,6 +22,12 @@ def pairs(iterable):
         old = new
 
 class GenericPen(object):
+    # Rough number of PDF operators paint_stroke emits for each stroke
+    # (q J j RG Q) and each segment (w n m l S).  Used to estimate the
+    # size of a page without drawing it.
+    STROKE_OPS = 5
+    SEGMENT_OPS = 5
+
     def __init__(self, color, *args, **kwargs):
         self.color = color
 
@@ -17,6 +17,10 @@
 from .generic import GenericPen
 
 class HighlighterPen(GenericPen):
+    # The stroke is a single path
+    STROKE_OPS = 9
+    SEGMENT_OPS = 1
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.layer = kwargs.get('layer')
@@ -18,6 +18,9 @@ from .generic import GenericPen
 from .textures import PENCIL_TEXTURES
 
 class MechanicalPencilPen(GenericPen):
+    # Also sets the color for each segment
+    SEGMENT_OPS = 6
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.vector = kwargs.get('vector', False)
@@ -31,25 +34,13 @@ class MechanicalPencilPen(GenericPen):
             stroke_color = [1 - (1 - c) * segment.pressure for c in self.color]
             canvas.setStrokeColor(stroke_color)
         else:
-            assert False
-            brush.setColor(self.color())
-            texture = PENCIL_TEXTURES.get_linear(0.00)
-            pressure_textures = [
-                PENCIL_TEXTURES.get_linear(0.10),
-                PENCIL_TEXTURES.get_linear(0.15),
-                PENCIL_TEXTURES.get_linear(0.20),
-                PENCIL_TEXTURES.get_linear(0.25),
-                PENCIL_TEXTURES.get_linear(0.30),
-                PENCIL_TEXTURES.get_linear(0.40),
-                PENCIL_TEXTURES.get_linear(0.50),
-                PENCIL_TEXTURES.get_linear(0.60),
-                PENCIL_TEXTURES.get_linear(0.70),
-                PENCIL_TEXTURES.get_linear(0.80),
-                PENCIL_TEXTURES.get_linear(0.90)
-            ]
+            canvas.setStrokeColor(self.color)
+            texture = 0.00
+            pressure_textures = [0.10, 0.15, 0.20, 0.25, 0.30, 0.40,
+                                 0.50, 0.60, 0.70, 0.80, 0.90]
             for n, tex in enumerate(pressure_textures):
                 threshold = n / len(pressure_textures)
                 if segment.pressure >= threshold:
                     texture = tex
-            brush.setTextureImage(texture)
-            self.setBrush(brush)
+            # Only look up the texture in use, so it is only loaded if needed
+            canvas.setStrokeTexture(PENCIL_TEXTURES.get_linear(texture))
@@ -24,6 +24,9 @@ def point_distance(x1, y1, x2, y2):
     return dist
 
 class PaintbrushPen(GenericPen):
+    # Also sets the color and cap for each segment
+    SEGMENT_OPS = 7
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.vector = kwargs.get('vector', False)
@@ -54,14 +57,11 @@ class PaintbrushPen(GenericPen):
             stroke_color = [1 - (1 - c) * press_mod / 2 for c in self.color]
             canvas.setStrokeColor(stroke_color)
         else:
-            assert False
-            angle = math.degrees(nextsegment.direction) + 90
-            transform = QTransform().rotate(angle)
-
-            texture = PENCIL_TEXTURES.get_log_paintbrush(press_mod)
-            brush.setTextureImage(texture)
-            brush.setTransform(transform)
-            self.setBrush(brush)
+            # The device rotates the texture to follow the stroke
+            # direction, but that makes little difference at this scale.
+            canvas.setStrokeColor(self.color)
+            canvas.setStrokeTexture(
+                PENCIL_TEXTURES.get_log_paintbrush(press_mod))
 
         # If the segment is short, use a round cap.
         distance = point_distance(segment.x, segment.y,
@@ -18,16 +18,41 @@ from .generic import GenericPen
 from .textures import PENCIL_TEXTURES
 
 class PencilPen(GenericPen):
+    # Also sets the color for each segment
+    SEGMENT_OPS = 6
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.vector = kwargs.get('vector', False)
+        self.spatter = False
+
+    def paint_stroke(self, canvas, stroke):
+        # There is a spatter around the pencil, drawn as a wider and
+        # lighter stroke behind the primary one.  This is only done
+        # when not vector, because there are compositing problems.
+        if not self.vector:
+            self.spatter = True
+            super().paint_stroke(canvas, stroke)
+            self.spatter = False
+        super().paint_stroke(canvas, stroke)
 
     def set_segment_properties(self, canvas, segment, nextsegment):
         basewidth = segment.width
         deltamax = 0.42 * basewidth
         delta = -deltamax
         prim_width = basewidth + delta
-        canvas.setLineWidth(prim_width)
 
-        stroke_color = [1 - (1 - c) * segment.pressure for c in self.color]
-        canvas.setStrokeColor(stroke_color)
+        if self.vector:
+            canvas.setLineWidth(prim_width)
+            stroke_color = [1 - (1 - c) * segment.pressure for c in self.color]
+            canvas.setStrokeColor(stroke_color)
+        elif self.spatter:
+            canvas.setLineWidth(prim_width * 1.25)
+            canvas.setStrokeTexture(
+                PENCIL_TEXTURES.get_log(segment.pressure * 0.7))
+        else:
+            canvas.setLineWidth(prim_width)
+            canvas.setStrokeTexture(PENCIL_TEXTURES.get_log(segment.pressure))
 
     def old_paint_stroke(self, painter, stroke):
         assert False
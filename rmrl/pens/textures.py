@@ -1,68 +1,68 @@
-#from PySide2.QtGui import QImage
+from functools import lru_cache
 from pathlib import Path
+import threading
 
-class PencilTextures:
-    def __init__(self):
-        # Load textures
-        self.textures_linear_pencil = []
-        texpath = Path(__file__).parent / Path('pencil_textures_linear')
-        texpaths = sorted(texpath.glob('*.ppm'))
-        for p in texpaths:
-            name = p.stem
-            img = QImage()
-            img.load(str(p))
-            self.textures_linear_pencil.append(img)
+# Most textures in use at once.  Each is a 100x100 greyscale image.
+TEXTURE_CACHE_SIZE = 64
+# Number of distinct textures used from each set.  The sets have about 100
+# textures each, finer than can be seen, so nearby pressures share one.
+TEXTURE_LEVELS = 20
 
-        self.textures_log_pencil = []
-        texpath = Path(__file__).parent / Path('pencil_textures_log')
-        texpaths = sorted(texpath.glob('*.ppm'))
-        for p in texpaths:
-            name = p.stem
-            img = QImage()
-            img.load(str(p))
-            self.textures_log_pencil.append(img)
+@lru_cache(maxsize=TEXTURE_CACHE_SIZE)
+def load_texture(path):
+    # Textures are stored black on white.  Return the ink coverage
+    # instead, so it can be used directly as a mask.
+    from PIL import Image, ImageOps
 
-        self.textures_log_paintbrush = []
-        texpath = Path(__file__).parent / Path('paintbrush_textures_log')
-        texpaths = sorted(texpath.glob('*.ppm'))
-        for p in texpaths:
-            name = p.stem
-            img = QImage()
-            img.load(str(p))
-            self.textures_log_paintbrush.append(img)
+    with Image.open(path) as img:
+        return ImageOps.invert(img.convert('L'))
 
-    def get_linear(self, val):
-        scale = len(self.textures_linear_pencil)
-        i = int(val * scale)
+class PencilTextures:
+    def __init__(self, levels=TEXTURE_LEVELS):
+        # Textures are only found and decoded when first used
+        self.levels = levels
+        self.texpaths = {}
+        # This is shared by all renders, which may be in different threads
+        self.lock = threading.Lock()
+
+    def get_paths(self, name):
+        with self.lock:
+            if name not in self.texpaths:
+                texpath = Path(__file__).parent / Path(name)
+                self.texpaths[name] = tuple(sorted(texpath.glob('*.ppm')))
+            return self.texpaths[name]
+
+    def get_texture(self, name, i):
+        texpaths = self.get_paths(name)
+        scale = len(texpaths)
         if i < 0:
             i = 0
         if i >= scale:
             i = scale - 1
-        return self.textures_linear_pencil[i]
+        # Quantize to one of self.levels textures
+        step = max(scale // self.levels, 1)
+        i = min(round(i / step) * step, scale - 1)
+        return load_texture(texpaths[i])
+
+    def get_linear(self, val):
+        scale = len(self.get_paths('pencil_textures_linear'))
+        return self.get_texture('pencil_textures_linear', int(val * scale))
 
     def get_log(self, val):
-        scale = len(self.textures_log_pencil)
+        scale = len(self.get_paths('pencil_textures_log'))
         # These values were reached by trial-and-error.
         if val < 0:
             val = 0
-        i = int(0.25 * (val * scale)**1.21)
-        if i < 0:
-            i = 0
-        if i >= scale:
-            i = scale - 1
-        return self.textures_log_pencil[i]
+        return self.get_texture('pencil_textures_log',
+                                int(0.25 * (val * scale)**1.21))
 
     def get_log_paintbrush(self, val):
-        scale = len(self.textures_log_paintbrush)
+        scale = len(self.get_paths('paintbrush_textures_log'))
         if val < 0:
             val = 0
-        i = int(0.25 * (val * scale)**1.21)
-        if i < 0:
-            i = 0
-        if i >= scale:
-            i = scale - 1
-        return self.textures_log_paintbrush[i]
+        return self.get_texture('paintbrush_textures_log',
+                                int(0.25 * (val * scale)**1.21))
 
-# Load pencil textures (shared for brushes, takes a lot of time
-# because there are many)
-PENCIL_TEXTURES = None #PencilTextures()
+# Pencil textures, shared for brushes.  There are many, so they are loaded
+# as needed and only a limited number are kept around.
+PENCIL_TEXTURES = PencilTextures()
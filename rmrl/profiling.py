@@ -0,0 +1,95 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import cProfile
+import tracemalloc
+
+from .render import import_dependencies, render_to
+from .stats import RenderStats
+
+TOP_ALLOCATIONS = 10
+
+def profile_render(source, dest, options, profile_path=None,
+                   trace_memory=False, out=None):
+    """
+    Render source to dest with the given options, as with render_to(),
+    reporting on where the time and memory went.
+
+    A table of the time taken by each stage and page is printed to out.
+    If profile_path is given, cProfile statistics are written there, for
+    use with pstats or snakeviz.  If trace_memory is true, tracemalloc is
+    used to find the peak memory used in each stage and the lines that
+    had the most memory allocated at the end.
+    """
+    stage_peaks = {}
+
+    def on_event(stage, page, wall, cpu):
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            stage_peaks[stage] = max(stage_peaks.get(stage, 0), peak)
+            # Before Python 3.9, this is the peak of the whole render
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+
+    # Keep the imports out of the measurements
+    import_dependencies()
+    stats = RenderStats(on_event=on_event)
+    profiler = cProfile.Profile() if profile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler:
+        profiler.enable()
+    try:
+        render_to(source, dest, stats=stats, **options)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')])
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    print_stats(stats, stage_peaks, out)
+    if trace_memory:
+        print_memory(snapshot, max([peak] + list(stage_peaks.values())), out)
+
+def print_stats(stats, stage_peaks, out):
+    print(f"{'Stage':<10} {'Count':>6} {'Wall (s)':>9} {'CPU (s)':>9}"
+          + (f" {'Peak (MB)':>10}" if stage_peaks else ''), file=out)
+    for name, (count, wall, cpu) in stats.stages.items():
+        line = f"{name:<10} {count:>6} {wall:>9.3f} {cpu:>9.3f}"
+        if stage_peaks:
+            line += f" {stage_peaks.get(name, 0) / 1024**2:>10.1f}"
+        print(line, file=out)
+    print(file=out)
+
+    print(f"{'Page':>5} {'Segments':>9} {'Vector':>7} {'Time (ms)':>10}", file=out)
+    for page, segments, vector, wall in stats.pages:
+        print(f"{page:>5} {segments:>9} {'yes' if vector else 'no':>7} "
+              f"{wall * 1000:>10.1f}", file=out)
+    print(file=out)
+
+    print(f"Read {stats.bytes_read} bytes, wrote {stats.output_bytes} bytes",
+          file=out)
+
+def print_memory(snapshot, peak, out):
+    print(f"Peak traced memory: {peak / 1024**2:.1f} MB", file=out)
+    print(f"Top {TOP_ALLOCATIONS} allocations still held at the end:", file=out)
+    for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+        print(f"  {stat}", file=out)
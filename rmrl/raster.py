@@ -0,0 +1,160 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+
+from PIL import Image, ImageChops, ImageDraw
+
+__doc__ = """
+A RasterCanvas provides the small part of the ReportLab canvas API that the
+pens use, but draws into a Pillow image instead of a PDF content stream.
+This lets the pens render to a bitmap without knowing about it.  An origin
+and scale may be given to draw only part of the page, or to draw it at a
+different size.
+
+It adds setStrokeTexture(), which takes a greyscale image giving the ink
+coverage.  This is tiled across the canvas and limits where strokes leave
+ink, like the textured brushes on the device.
+"""
+
+class RasterPath:
+
+    def __init__(self):
+        self.points = []
+
+    def moveTo(self, x, y):
+        self.points = [(x, y)]
+
+    def lineTo(self, x, y):
+        self.points.append((x, y))
+
+
+class RasterCanvas:
+
+    def __init__(self, width, height, origin=(0, 0), scale=1):
+        # Transparent white, so that viewers scaling the colors and the
+        # alpha separately don't give light strokes dark edges
+        self.image = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+        self.draw = ImageDraw.Draw(self.image)
+        # The point drawn at the top left corner, and the pixels per unit
+        self.origin = origin
+        self.scale = scale
+        self.state = dict(width=1, cap=0, color=(0, 0, 0), alpha=1,
+                          texture=None)
+        self.saved = []
+
+    def saveState(self):
+        self.saved.append(dict(self.state))
+
+    def restoreState(self):
+        self.state = self.saved.pop()
+
+    def setLineWidth(self, width):
+        self.state['width'] = width
+
+    def setLineCap(self, cap):
+        self.state['cap'] = cap
+
+    def setLineJoin(self, join):
+        # Joins are always drawn rounded
+        pass
+
+    def setStrokeColor(self, color, alpha=None):
+        self.state['color'] = tuple(color)
+        if alpha is not None:
+            self.state['alpha'] = alpha
+
+    def setStrokeTexture(self, texture):
+        self.state['texture'] = texture
+
+    def line(self, x1, y1, x2, y2):
+        self.stroke_points([(x1, y1), (x2, y2)])
+
+    def beginPath(self):
+        return RasterPath()
+
+    def drawPath(self, path, stroke=1, fill=0):
+        if stroke and path.points:
+            self.stroke_points(path.points)
+
+    def stroke_points(self, points):
+        if self.origin != (0, 0) or self.scale != 1:
+            (ox, oy), scale = self.origin, self.scale
+            points = [((x - ox) * scale, (y - oy) * scale) for x, y in points]
+        width = self.state['width'] * self.scale
+        if self.state['cap'] == 2:
+            points = extend_ends(points, width / 2)
+        color = tuple(round(255 * c) for c in self.state['color'])
+        alpha = self.state['alpha']
+        texture = self.state['texture']
+        if alpha >= 1 and texture is None:
+            self.paint(self.draw, points, width, color + (255,))
+            return
+
+        # ImageDraw replaces pixels instead of blending them, so draw
+        # translucent or textured strokes into a mask over their bounding
+        # box and composite that onto the image.
+        pad = width / 2 + 1
+        left = max(int(min(x for x, _ in points) - pad), 0)
+        top = max(int(min(y for _, y in points) - pad), 0)
+        right = min(int(max(x for x, _ in points) + pad) + 1, self.image.width)
+        bottom = min(int(max(y for _, y in points) + pad) + 1, self.image.height)
+        if right <= left or bottom <= top:
+            return
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        self.paint(ImageDraw.Draw(mask),
+                   [(x - left, y - top) for x, y in points],
+                   width, round(255 * alpha))
+        if texture is not None:
+            mask = ImageChops.multiply(
+                mask, tile(texture, (left, top, right, bottom)))
+        overlay = Image.new('RGBA', mask.size, color + (0,))
+        overlay.putalpha(mask)
+        self.image.alpha_composite(overlay, (left, top))
+
+    def paint(self, draw, points, width, fill):
+        iwidth = max(round(width), 1)
+        draw.line(points, fill=fill, width=iwidth, joint='curve')
+        if self.state['cap'] == 1 and iwidth > 1:
+            r = width / 2
+            for x, y in (points[0], points[-1]):
+                draw.ellipse((x - r, y - r, x + r, y + r), fill=fill)
+
+
+def extend_ends(points, distance):
+    # Lengthen a polyline at both ends, to imitate square caps
+    if len(points) < 2:
+        return points
+
+    def extend(p, q):
+        dx, dy = p[0] - q[0], p[1] - q[1]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            return p
+        return (p[0] + dx / length * distance, p[1] + dy / length * distance)
+
+    return ([extend(points[0], points[1])] + points[1:-1]
+            + [extend(points[-1], points[-2])])
+
+
+def tile(texture, box):
+    # The part of the canvas-wide tiling of texture that falls in box
+    left, top, right, bottom = box
+    tw, th = texture.size
+    result = Image.new(texture.mode, (right - left, bottom - top))
+    for y in range(top - top % th, bottom, th):
+        for x in range(left - left % tw, right, tw):
+            result.paste(texture, (x - left, y - top))
+    return result
@@ -0,0 +1,158 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+
+from . import document, sources
+from .constants import DISPLAY, PDFHEIGHT, PTPERPX
+
+__doc__ = """
+Render part of a single page, for previews and crops.
+
+Only the page asked for is read, and only the strokes that reach into the
+region are drawn, so the cost depends on the ink visible, not on the size
+of the document.
+"""
+
+FORMATS = ('pdf', 'png', 'svg')
+
+def render_region(source, page, bbox=None, scale=1, format='png',
+                  template_alpha=0.3):
+    """
+    Render a rectangle of one page of a document.
+
+    source: The reMarkable document, as for render().
+    page: The index of the page, starting from 0.
+    bbox: The rectangle to draw, as (left, top, right, bottom) in the
+          device's pixels, which run from (0, 0) at the top left to (1404,
+          1872).  None (default) draws the whole page.
+    scale: The size of the output, relative to the page's normal size.
+           That is device pixels for 'png' and 'svg', and the same points
+           as render() would make for 'pdf'.
+    format: 'png' (default), 'pdf', or 'svg'.
+    template_alpha: Opacity of the page's template.  0 leaves it out.
+
+    Only the annotations and the template are drawn, not a page of the
+    base PDF.  Returns the bytes of the file.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}")
+    if bbox is None:
+        bbox = (0, 0, DISPLAY['screenwidth'], DISPLAY['screenheight'])
+    left, top, right, bottom = bbox
+    if right <= left or bottom <= top or scale <= 0:
+        raise ValueError(f"Empty region {bbox} at scale {scale}")
+
+    source = sources.get_source(source)
+    pages = []
+    if source.exists('{ID}.content'):
+        with source.open('{ID}.content', 'r') as f:
+            pages = json.load(f).get('pages', [])
+    if not 0 <= page < len(pages):
+        raise IndexError(f"Page {page} not in document of {len(pages)} pages")
+    doc_page = document.DocumentPage(source, pages[page], page)
+    doc_page.cull_strokes(bbox)
+    if template_alpha <= 0:
+        doc_page.template = None
+
+    return {'pdf': region_pdf, 'png': region_png,
+            'svg': region_svg}[format](doc_page, bbox, scale, template_alpha)
+
+def region_pdf(page, bbox, scale, template_alpha):
+    from reportlab.graphics import renderPDF
+    from reportlab.pdfgen import canvas
+
+    left, top, right, bottom = bbox
+    # Points of output per device pixel
+    k = PTPERPX * scale
+    width, height = (right - left) * k, (bottom - top) * k
+    out = io.BytesIO()
+    pdf = canvas.Canvas(out, (width, height))
+
+    if page.template:
+        # The template is drawn in points, with y running upwards
+        pdf.saveState()
+        pdf.translate(-left * k, (bottom * PTPERPX - PDFHEIGHT) * scale)
+        pdf.scale(scale, scale)
+        template = document.load_template(page.template)
+        with document.TEMPLATE_LOCK:
+            renderPDF.draw(template, pdf, 0, 0)
+        pdf.restoreState()
+        if template_alpha < 1:
+            pdf.saveState()
+            pdf.setFillColorRGB(1., 1., 1.)
+            pdf.setFillAlpha(1 - template_alpha)
+            pdf.rect(0, 0, width, height, fill=True, stroke=False)
+            pdf.restoreState()
+
+    pdf.translate(-left * k, bottom * k)
+    pdf.scale(k, -k)
+    for layer in page.layers:
+        layer.paint_strokes(pdf, vector=True)
+    pdf.showPage()
+    pdf.save()
+    return out.getvalue()
+
+def region_png(page, bbox, scale, template_alpha):
+    from PIL import Image
+    from . import raster
+
+    left, top, right, bottom = bbox
+    width = max(round((right - left) * scale), 1)
+    height = max(round((bottom - top) * scale), 1)
+    image = Image.new('RGBA', (width, height), (255, 255, 255, 255))
+
+    if page.template:
+        from reportlab.graphics import renderPM
+        from reportlab.graphics.shapes import Drawing, Group
+
+        # Place the template, which is in points with y running upwards,
+        # in a drawing of the region.
+        m = scale / PTPERPX
+        template = document.load_template(page.template)
+        region = Drawing(width, height)
+        region.add(Group(template, transform=(
+            m, 0, 0, m, -left * scale, (bottom * PTPERPX - PDFHEIGHT) * m)))
+        with document.TEMPLATE_LOCK:
+            background = renderPM.drawToPIL(region, dpi=72).convert('RGBA')
+        image = Image.blend(image, background.resize(image.size), template_alpha)
+
+    strokes = raster.RasterCanvas(width, height, origin=(left, top), scale=scale)
+    for layer in page.layers:
+        layer.paint_strokes(strokes, vector=False)
+    image.alpha_composite(strokes.image)
+
+    out = io.BytesIO()
+    image.convert('RGB').save(out, 'PNG')
+    return out.getvalue()
+
+def region_svg(page, bbox, scale, template_alpha):
+    from .svg import SVG_NS, SvgCanvas, template_svg
+
+    left, top, right, bottom = bbox
+    width, height = right - left, bottom - top
+    out = io.StringIO()
+    out.write(f'<svg xmlns="{SVG_NS}" width="{width * scale:g}" '
+              f'height="{height * scale:g}" viewBox="{left:g} {top:g} {width:g} {height:g}">\n')
+    if page.template:
+        out.write(f'<g opacity="{template_alpha:g}">{template_svg(page.template)}</g>\n')
+    out.write('<g fill="none">\n')
+    strokes = SvgCanvas(out)
+    for layer in page.layers:
+        layer.paint_strokes(strokes, vector=True)
+    strokes.flush()
+    out.write('</g>\n</svg>\n')
+    return out.getvalue().encode()
@@ -14,28 +14,69 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import hashlib
 import logging
+import os
+import shutil
 import tempfile
 from pathlib import Path
 import json
 import re
-
-from pdfrw import PdfReader, PdfWriter, PageMerge, PdfDict, PdfArray, PdfName, \
-    IndirectPdfDict, uncompress, compress
-
-from reportlab.pdfgen import canvas
+import time
+import uuid
 
 from . import document, sources
-from .constants import PDFHEIGHT, PDFWIDTH, PTPERPX, SPOOL_MAX
+from .stats import stage
+from .constants import (COMPRESSION_LEVEL, PDFHEIGHT, PDFWIDTH, PTPERPX,
+                        PREFETCH_PAGES, SPOOL_MAX)
+
+COPY_BUFSIZE = 1024 * 1024
 
 
 log = logging.getLogger(__name__)
 
-def render(source, *,
-           progress_cb=lambda x: None,
-           expand_pages=True,
-           template_alpha=0.3,
-           only_annotated=False):
+class BudgetExceeded(Exception):
+    # reason is the name of the budget that was exceeded, and page the
+    # index of the page being worked on, or None if the output was done.
+    def __init__(self, reason, page):
+        super().__init__(f"Render budget {reason} exceeded at page {page}")
+        self.reason = reason
+        self.page = page
+
+
+class RenderBudget:
+    # Keeps track of the resources used by a render, compared to the limits
+
+    def __init__(self, deadline=None, max_segments=None, max_output_bytes=None):
+        self.end = time.monotonic() + deadline if deadline is not None else None
+        self.max_segments = max_segments
+        self.max_output_bytes = max_output_bytes
+        self.segments = 0
+        self.output_bytes = 0
+
+    def counts_pages(self):
+        return self.max_segments is not None or self.max_output_bytes is not None
+
+    def add_page(self, complexity):
+        self.segments += complexity.segments
+        self.output_bytes += complexity.stream_bytes
+
+    def past_deadline(self):
+        return self.end is not None and time.monotonic() > self.end
+
+    def exceeded(self):
+        # Returns the name of the first budget exceeded, or None
+        if self.past_deadline():
+            return 'deadline'
+        if self.max_segments is not None and self.segments > self.max_segments:
+            return 'max_segments'
+        if (self.max_output_bytes is not None
+                and self.output_bytes > self.max_output_bytes):
+            return 'max_output_bytes'
+        return None
+
+
+def render(source, **kwargs):
     """
     Render a source document as a PDF file.
 
@@ -59,10 +100,160 @@ def render(source, *,
                     makes the templates invisible, 1 makes them fully dark.
     only_annotated: Boolean value (default False) indicating whether only
                     pages with annotations should be output.
+    page_budget: The largest page, as a document.PageComplexity (or a dict
+                 with the same keys), to draw as vectors.  Pages estimated
+                 to exceed any of its segments, operators, or stream_bytes
+                 are drawn as bitmaps instead.  None (default) draws every
+                 page as vectors.
+    complexity_cb: A function which will be called once the pages are
+                   drawn, with the page budget in use and a dict mapping
+                   the index of each page drawn as a bitmap to its
+                   estimated PageComplexity.
+    deadline: Number of seconds allowed for the render, or None (default)
+              for no limit.
+    max_segments: Number of stroke segments to draw, or None (default)
+                  for no limit.
+    max_output_bytes: Estimated size of the drawn pages, or None (default)
+                      for no limit.  With budget_action='raise', the size
+                      of the finished PDF file is also checked.
+    budget_action: What to do when one of the budgets above is exceeded.
+                   The budgets are checked before each page is drawn and
+                   before each is merged with the base PDF.
+                     - 'raise' (default): Raise BudgetExceeded.
+                     - 'raster': Draw the remaining pages as bitmaps.
+                       Pages are still merged after the deadline.
+                     - 'partial': Leave the remaining pages without their
+                       annotations.
+    budget_cb: A function which will be called if a budget was exceeded,
+               with the name of that budget and a list of the indices of
+               the pages with strokes drawn as bitmaps, or annotations
+               left out.
+    stats: A rmrl.stats.RenderStats object, which will be filled in with
+           the time taken by each stage of rendering, and other counts.
+    prefetch_pages: Number of pages whose files are read, on a background
+                    thread, ahead of the page being drawn.  0 reads each
+                    page's files as it is drawn.
+    compact: Boolean value (default False) indicating whether to write a
+             smaller PDF 1.5 file, with the objects packed into compressed
+             object streams.  This takes a little longer, and some old
+             PDF readers can't open these files.
+    compression_level: The zlib compression level, from 0 (no compression)
+                       to 9, of the content streams.  These are compressed
+                       in a pool of threads, to make use of all the cores.
+    deterministic: Boolean value (default False) indicating whether the
+                   same document and options should always give the same
+                   bytes.  The timestamps are fixed, and the file ID is
+                   a hash of the document's files and the options.  (A
+                   deadline may still make the output depend on timing.)
+
+    Returns a file object with the PDF file, which is kept in memory if
+    small, and spooled to disk if large.  To write the PDF file straight
+    to its destination, use render_to().
+
+    This may be called from several threads at once.  Each render keeps its
+    own state, and the caches of templates and textures they share are
+    safe to use together.
     """
+    stream = tempfile.SpooledTemporaryFile(SPOOL_MAX)
+    try:
+        _render(source, stream, **kwargs)
+    except BaseException:
+        stream.close()
+        raise
+    stream.seek(0)
+    return stream
 
-    vector=True  # TODO: Different rendering styles
-    source = sources.get_source(source)
+
+def render_to(source, dest, **kwargs):
+    """
+    Render a source document as a PDF file, writing it to dest.
+
+    dest may be a filename or pathlib.Path, or a writable binary file
+    object.  A file is written under a temporary name in the same directory,
+    and renamed to dest once complete, so dest is never left half written.
+    A file object is written to directly, without seeking, so it may be a
+    pipe; it is left open.  With max_output_bytes and budget_action='raise',
+    the PDF is spooled and only copied to a file object once it is known
+    to fit, so nothing is written if BudgetExceeded is raised.  The other
+    arguments are as for render().
+
+    Returns the number of bytes written.
+    """
+    if hasattr(dest, 'write'):
+        if (kwargs.get('max_output_bytes') is not None
+                and kwargs.get('budget_action', 'raise') == 'raise'):
+            fout = CountingWriter(dest)
+            with render(source, **kwargs) as stream:
+                shutil.copyfileobj(stream, fout, COPY_BUFSIZE)
+            return fout.count
+        return _render_to_file(source, dest, kwargs)
+
+    dest = Path(dest)
+    tmp_path = dest.with_name(f'.{dest.name}.{uuid.uuid4().hex[:8]}.part')
+    try:
+        with open(tmp_path, 'xb') as fout:
+            nbytes = _render_to_file(source, fout, kwargs)
+        os.replace(tmp_path, dest)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    return nbytes
+
+def _render_to_file(source, fout, kwargs):
+    fout = CountingWriter(fout)
+    _render(source, fout, **kwargs)
+    return fout.count
+
+
+class CountingWriter:
+    # Counts the bytes written to a file object, which need not support
+    # tell(), as when writing to a pipe.
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.f.write(data)
+
+
+def _render(source, fout, *,
+            progress_cb=lambda x: None,
+            expand_pages=True,
+            template_alpha=0.3,
+            only_annotated=False,
+            page_budget=None,
+            complexity_cb=lambda budget, rasterized: None,
+            deadline=None,
+            max_segments=None,
+            max_output_bytes=None,
+            budget_action='raise',
+            budget_cb=lambda reason, pages: None,
+            stats=None,
+            prefetch_pages=PREFETCH_PAGES,
+            compact=False,
+            compression_level=COMPRESSION_LEVEL,
+            deterministic=False):
+    # Writes the PDF file to fout
+
+    # These are slow to import, so wait until they're needed
+    from pdfrw import PdfReader, PdfWriter, PdfDict, PdfArray, IndirectPdfDict
+    from reportlab.pdfgen import canvas
+    from . import pdfwrite
+
+    if budget_action not in ('raise', 'raster', 'partial'):
+        raise ValueError(f"Unknown budget_action {budget_action!r}")
+    budget = RenderBudget(deadline, max_segments, max_output_bytes)
+    over_budget = None
+    degraded_pages = []
+
+    base_source = source = sources.get_source(source)
+    if stats is not None:
+        source = stats.wrap_source(source)
+    if isinstance(page_budget, dict):
+        page_budget = document.PageComplexity(**page_budget)
 
     # If this is using a base PDF, the percentage is calculated
     # differently.
@@ -78,43 +269,101 @@ def render(source, *,
         with source.open('{ID}.content', 'r') as f:
             pages = json.load(f).get('pages', [])
 
-    # Render each page as a pdf
-    tmpfh = tempfile.TemporaryFile()
-    pdf_canvas = canvas.Canvas(tmpfh, (PDFWIDTH, PDFHEIGHT))
-    # TODO: check pageCompression
-
-    # Don't load all the pages into memory, because large notebooks
-    # about 500 pages could use up to 3 GB of RAM. Create them by
-    # iteration so they get released by garbage collector.
-    changed_pages = []
-    annotations = []
-    for i in range(0, len(pages)):
-        page = document.DocumentPage(source, pages[i], i)
-        if source.exists(page.rmpath):
-            changed_pages.append(i)
-        page.render_to_painter(pdf_canvas, vector, template_alpha)
-        annotations.append(page.get_grouped_annotations())
-        progress_cb((i + 1) / len(pages) * 50)
-    pdf_canvas.save()
-    tmpfh.seek(0)
-
-    # This new PDF represents just the notebook. If there was a
-    # parent PDF, merge it now.
-    if uses_base_pdf and not changed_pages:
-        # Since there is no stroke data, just return the PDF data
-        progress_cb(100)
-
-        log.info('exported pdf')
-        return source.open('{ID}.pdf', 'rb')
-
-    # PDF exists, stroke data exists, so mix them together.
-    if uses_base_pdf:
-        rmpdfr = PdfReader(tmpfh)
-        basepdfr = PdfReader(source.open('{ID}.pdf', 'rb'))
-    else:
-        basepdfr = PdfReader(tmpfh)
-        # Alias, which is used for annotations and layers.
-        rmpdfr = basepdfr
+    # Render each page as a pdf.  The temporary file is closed once it has
+    # been read back in, or if anything goes wrong before then.
+    with tempfile.TemporaryFile() as tmpfh, \
+            sources.PrefetchSource(base_source, pages, prefetch_pages) as prefetcher:
+        # Count the bytes as they are used, not as they are read ahead
+        page_source = prefetcher
+        if stats is not None:
+            page_source = stats.wrap_source(prefetcher)
+        # The pages are compressed later, all at once, so that it can be
+        # done in parallel.
+        pdf_canvas = canvas.Canvas(tmpfh, (PDFWIDTH, PDFHEIGHT),
+                                   pageCompression=False,
+                                   invariant=deterministic)
+
+        # Don't load all the pages into memory, because large notebooks
+        # about 500 pages could use up to 3 GB of RAM. Create them by
+        # iteration so they get released by garbage collector.
+        changed_pages = []
+        annotations = []
+        rasterized = {}
+        for i in range(0, len(pages)):
+            page_start = time.perf_counter()
+            prefetcher.advance(i)
+            if not (over_budget and budget_action == 'partial'):
+                with stage(stats, 'parse', i):
+                    page = document.DocumentPage(page_source, pages[i], i)
+                complexity = None
+                if (page_budget is not None or budget.counts_pages()
+                        or stats is not None):
+                    complexity = page.estimate_complexity()
+                    budget.add_page(complexity)
+                if not over_budget:
+                    over_budget = budget.exceeded()
+                    if over_budget and budget_action == 'raise':
+                        raise BudgetExceeded(over_budget, i)
+                    elif over_budget:
+                        log.warning(f'{over_budget} exceeded at page {i}')
+
+            if over_budget and budget_action == 'partial':
+                # Leave a blank page, so the pages still line up with
+                # those of the base PDF.
+                pdf_canvas.showPage()
+                annotations.append([])
+                if page_source.exists(document.page_rmpath(page_source, pages[i], i)):
+                    degraded_pages.append(i)
+            else:
+                if page_source.exists(page.rmpath):
+                    changed_pages.append(i)
+                vector = True
+                if page_budget is not None and complexity.exceeds(page_budget):
+                    log.info(f'drawing page {i} as bitmap: {complexity}')
+                    rasterized[i] = complexity
+                    vector = False
+                elif over_budget and any(layer.strokes for layer in page.layers):
+                    # Pages without strokes look the same either way
+                    degraded_pages.append(i)
+                    vector = False
+                page.render_to_painter(pdf_canvas, vector, template_alpha, stats)
+                annotations.append(page.get_grouped_annotations())
+                if stats is not None:
+                    stats.add_page(i, complexity.segments, vector,
+                                   time.perf_counter() - page_start)
+            progress_cb((i + 1) / len(pages) * 50)
+        with stage(stats, 'save'):
+            pdf_canvas.save()
+        complexity_cb(page_budget, rasterized)
+        tmpfh.seek(0)
+
+        # This new PDF represents just the notebook. If there was a
+        # parent PDF, merge it now.
+        if uses_base_pdf and not changed_pages:
+            # Since there is no stroke data, just copy the PDF data
+            with stage(stats, 'write'):
+                counter = CountingWriter(fout)
+                with source.open('{ID}.pdf', 'rb') as base_pdf:
+                    shutil.copyfileobj(base_pdf, counter, COPY_BUFSIZE)
+            if stats is not None:
+                stats.output_bytes = counter.count
+            progress_cb(100)
+            if over_budget:
+                budget_cb(over_budget, sorted(degraded_pages))
+
+            log.info('exported pdf')
+            return
+
+        # PDF exists, stroke data exists, so mix them together.
+        with stage(stats, 'read_pdf'):
+            if uses_base_pdf:
+                rmpdfr = PdfReader(tmpfh)
+                with source.open('{ID}.pdf', 'rb') as f:
+                    basepdfr = PdfReader(f)
+            else:
+                basepdfr = PdfReader(tmpfh)
+                # Alias, which is used for annotations and layers.
+                rmpdfr = basepdfr
 
     # If making a 'layered' PDF (with optional content groups,
     # OCGs), associate the annoatations with the layer.
@@ -146,7 +395,17 @@ def render(source, *,
         # just add the annotations and forget about the rest,
         # which are page geometry transformations.
         if uses_base_pdf:
-            merge_pages(basepage, rmpage, i in changed_pages, expand_pages)
+            changed = i in changed_pages
+            if changed and budget_action != 'raster' and budget.past_deadline():
+                if budget_action == 'raise':
+                    raise BudgetExceeded('deadline', i)
+                if not over_budget:
+                    over_budget = 'deadline'
+                    log.warning(f'{over_budget} exceeded at page {i}')
+                changed = False
+                degraded_pages.append(i)
+            with stage(stats, 'merge', i):
+                merge_pages(basepage, rmpage, changed, expand_pages)
 
         progress_cb(((i + 1) / rmpdfr.numPages * 50) + 50)
 
@@ -161,23 +420,104 @@ def render(source, *,
         else:
             basepdfr.Root.OCProperties = ocgprop
 
-    stream = tempfile.SpooledTemporaryFile(SPOOL_MAX)
-    pdfw = PdfWriter(stream)
-    if not only_annotated:
-        # We are writing out everything, so we can take this shortcut:
-        pdfw.write(trailer=basepdfr)
-    else:
-        for i, page in enumerate(basepdfr.pages):
-            if i in changed_pages:
-                pdfw.addpage(page)
-        pdfw.write()
-    stream.seek(0)
+    output_pages = basepdfr.pages
+    if only_annotated:
+        output_pages = [page for i, page in enumerate(output_pages)
+                        if i in changed_pages]
+    with stage(stats, 'compress'):
+        dedupe_streams(output_pages)
+        pdfwrite.compress_streams(output_pages, compression_level)
+
+    with stage(stats, 'write'):
+        counter = CountingWriter(fout)
+        pdfw = PdfWriter(counter)
+        if not only_annotated:
+            # We are writing out everything, so we can take this shortcut:
+            trailer = basepdfr
+        else:
+            pdfw.addpages(output_pages)
+            trailer = pdfw.trailer
+        if deterministic:
+            options = (expand_pages, template_alpha, only_annotated,
+                       page_budget, compact, compression_level)
+            set_document_id(trailer, document_digest(base_source, pages, options),
+                            keep_original=uses_base_pdf)
+        if compact:
+            pdfwrite.write_compact(counter, trailer, pdfw.killobj,
+                                   compression_level)
+        else:
+            pdfw.write(trailer=trailer)
+    if (budget_action == 'raise' and max_output_bytes is not None
+            and counter.count > max_output_bytes):
+        raise BudgetExceeded('max_output_bytes', None)
+    if stats is not None:
+        stats.output_bytes = counter.count
+    if over_budget:
+        budget_cb(over_budget, sorted(degraded_pages))
 
     log.info('exported pdf')
-    return stream
+
+
+def import_dependencies():
+    # The libraries used for rendering are only imported when first
+    # needed.  Call this to get that out of the way beforehand.
+    import pdfrw
+    import reportlab.graphics.renderPDF
+    import reportlab.pdfgen.canvas
+    import svglib.svglib
+
+
+async def render_async(source, *, progress_cb=lambda x: None, executor=None,
+                       **kwargs):
+    """
+    Render a source document as a PDF file, without blocking the event loop.
+
+    This takes the same arguments as render(), which it runs in executor
+    (the loop's default executor if None).  progress_cb is called from
+    the executor's thread.
+
+    If this is cancelled, whether directly or by asyncio.wait_for() timing
+    out, rendering stops after the current page, and the cancellation is
+    propagated only once any temporary files have been closed.
+    """
+    import asyncio
+    import functools
+    import threading
+
+    cancelled = threading.Event()
+
+    def check_cancelled(progress):
+        if cancelled.is_set():
+            raise asyncio.CancelledError()
+        progress_cb(progress)
+
+    def close_result(future):
+        if not future.cancelled() and future.exception() is None:
+            future.result().close()
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(executor, functools.partial(
+        render, source, progress_cb=check_cancelled, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        cancelled.set()
+        # Wait for the render to stop, so it cleans up after itself.  If
+        # this is cancelled again meanwhile, the output is closed once the
+        # render finishes.
+        try:
+            await asyncio.shield(future)
+        except Exception:
+            pass
+        finally:
+            future.add_done_callback(close_result)
+        raise
 
 
 def do_apply_ocg(basepage, rmpage, i, uses_base_pdf, ocgprop, annotations):
+    from pdfrw import PdfDict, PdfArray, PdfName, IndirectPdfDict, \
+        uncompress, compress
+
     ocgpage = IndirectPdfDict(
         Type=PdfName('OCG'),
         Name='Page ' + str(i+1))
@@ -390,6 +730,8 @@ def do_apply_ocg(basepage, rmpage, i, uses_base_pdf, ocgprop, annotations):
 
 
 def apply_annotations(rmpage, page_annot, ocgorderinner):
+    from pdfrw import PdfDict, PdfArray, PdfName
+
     for k, layer_a in enumerate(page_annot):
         layerannots = layer_a[1]
         for a in layerannots:
@@ -417,6 +759,8 @@ def apply_annotations(rmpage, page_annot, ocgorderinner):
 
 
 def merge_pages(basepage, rmpage, changed_page, expand_pages):
+    from pdfrw import PageMerge, PdfArray
+
     # The general appraoch is to keep the base PDF. So, all
     # operations must be made upon the basepage. PyPDF2 will
     # keep all those pages' metadata and annotations,
@@ -592,3 +936,87 @@ def merge_pages(basepage, rmpage, changed_page, expand_pages):
         if not '/Annots' in basepage:
             basepage.Annots = PdfArray()
         basepage.Annots += rmpage.Annots
+
+
+def document_digest(source, pages, options):
+    # A hash of the files that go into the document, and the options used
+    # to render it
+    digest = hashlib.md5(repr(options).encode())
+    names = ['{ID}.content', '{ID}.pagedata', '{ID}.pdf']
+    for page_id in pages:
+        names += [f'{{ID}}/{page_id}.rm', f'{{ID}}/{page_id}-metadata.json']
+    for name in names:
+        if not source.exists(name):
+            continue
+        file_digest = hashlib.md5()
+        with source.open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(COPY_BUFSIZE), b''):
+                file_digest.update(chunk)
+        digest.update(f'{name}:{file_digest.hexdigest()}\n'.encode())
+    return digest.digest()
+
+def set_document_id(trailer, digest, keep_original):
+    # The first part of the ID is meant to stay the same through all
+    # versions of a file, so a base PDF's may be kept.  The second part
+    # identifies this version.
+    from pdfrw import PdfArray, PdfString
+
+    this_id = PdfString.from_bytes(digest, bytes_encoding='hex')
+    if keep_original and trailer.ID and len(trailer.ID) == 2:
+        trailer.ID = PdfArray([trailer.ID[0], this_id])
+    else:
+        trailer.ID = PdfArray([this_id, this_id])
+
+def dedupe_streams(pages):
+    # Pages without annotations, or with only a template, end up with
+    # identical content streams, as can the forms and images they draw.
+    # Replace each copy with the first one seen, so that the writer only
+    # writes it once.
+    from pdfrw import PdfArray
+
+    unique = {}
+    done = set()
+
+    def intern(obj):
+        if obj is None or obj.stream is None:
+            return obj
+        if id(obj) not in done:
+            done.add(id(obj))
+            resources = obj.Resources
+            if resources is not None and resources.XObject is not None:
+                intern_xobjects(resources.XObject)
+        return unique.setdefault((obj.stream, stream_key(obj)), obj)
+
+    def intern_xobjects(xobjects):
+        for name, xobj in list(xobjects.items()):
+            xobjects[name] = intern(xobj)
+
+    for page in pages:
+        contents = page.Contents
+        if isinstance(contents, PdfArray):
+            for i, stream in enumerate(contents):
+                contents[i] = intern(stream)
+        else:
+            page.Contents = intern(contents)
+        resources = page.Resources
+        if resources is not None and resources.XObject is not None:
+            intern_xobjects(resources.XObject)
+
+def stream_key(obj):
+    # A hashable version of a stream's dictionary.  Indirect objects and
+    # other streams are compared by identity, and so must be interned
+    # first for copies of them to match.
+    from pdfrw import PdfArray, PdfDict
+
+    def key(value):
+        if isinstance(value, PdfDict):
+            if value.indirect or value.stream is not None:
+                return ('ref', id(value))
+            return ('dict', tuple(sorted((k, key(v)) for k, v in value.items())))
+        if isinstance(value, PdfArray):
+            if value.indirect:
+                return ('ref', id(value))
+            return ('array', tuple(key(v) for v in value))
+        return ('value', str(value))
+
+    return tuple(sorted((k, key(v)) for k, v in obj.items() if k != '/Length'))
@@ -0,0 +1,224 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+from .cli import add_render_arguments, render_options
+from .render import import_dependencies
+
+
+log = logging.getLogger(__name__)
+
+__doc__ = """
+A long-running HTTP server for rendering documents.
+
+POST a document zip file to /render, and the PDF file comes back in the
+response.  The render options may be given in the query string, with the
+same names as the command-line options:
+
+    curl --data-binary @doc.zip 'http://localhost:8000/render?alpha=0.5' > doc.pdf
+
+Rendering happens in a pool of worker processes, which stay up between
+requests, so imports and parsed templates are reused.  Requests beyond
+those being rendered wait in a bounded queue; once that is full, further
+requests get a 503 response, and should be retried later.
+
+GET /status returns the number of renders in progress and waiting.
+"""
+
+COPY_BUFSIZE = 1024 * 1024
+
+def render_file(input_path, options):
+    # Render the zip file at input_path in a worker process.  The PDF is
+    # written to a temporary file, whose name is returned, so that it
+    # need not be sent back through a pipe.
+    from . import render_to
+
+    fd, output_path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            render_to(input_path, fout, **options)
+    except BaseException:
+        os.unlink(output_path)
+        raise
+    return output_path
+
+
+class RenderServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, defaults, jobs=None, queue_size=8):
+        super().__init__(address, RenderHandler)
+        self.defaults = defaults
+        self.jobs = jobs or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(self.jobs)
+        # Held by each request being rendered or waiting to be
+        self.slots = threading.BoundedSemaphore(self.jobs + queue_size)
+        self.lock = threading.Lock()
+        self.active = 0
+        # Get the imports done in each worker, so the first requests
+        # don't have to wait for them
+        for _ in range(self.jobs):
+            self.executor.submit(import_dependencies)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+
+    def render(self, input_path, options):
+        with self.lock:
+            self.active += 1
+        try:
+            return self.executor.submit(render_file, input_path, options).result()
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/status':
+            return self.send_error(HTTPStatus.NOT_FOUND)
+        with self.server.lock:
+            active = self.server.active
+        body = json.dumps({'jobs': self.server.jobs,
+                           'active': min(active, self.server.jobs),
+                           'queued': max(active - self.server.jobs, 0)}).encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/render':
+            return self.send_error(HTTPStatus.NOT_FOUND)
+        try:
+            options = self.get_options(parse_qs(url.query, keep_blank_values=True))
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError) as e:
+            return self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+
+        if not self.server.slots.acquire(blocking=False):
+            self.send_response(HTTPStatus.SERVICE_UNAVAILABLE)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        input_path = output_path = None
+        try:
+            fd, input_path = tempfile.mkstemp(suffix='.zip')
+            with os.fdopen(fd, 'wb') as fin:
+                try:
+                    copy_limited(self.rfile, fin, length)
+                except EOFError as e:
+                    return self.send_error(HTTPStatus.BAD_REQUEST, str(e))
+            try:
+                output_path = self.server.render(input_path, options)
+            except Exception as e:
+                log.error(f"Failed to render: {e}")
+                return self.send_error(HTTPStatus.UNPROCESSABLE_ENTITY, str(e))
+
+            self.send_response(HTTPStatus.OK)
+            self.send_header('Content-Type', 'application/pdf')
+            self.send_header('Content-Length', str(os.path.getsize(output_path)))
+            self.end_headers()
+            with open(output_path, 'rb') as fout:
+                shutil.copyfileobj(fout, self.wfile, COPY_BUFSIZE)
+        finally:
+            self.server.slots.release()
+            for path in (input_path, output_path):
+                if path is not None:
+                    os.unlink(path)
+
+    def get_options(self, query):
+        # Start from the server's options, and override with the query
+        options = dict(self.server.defaults)
+        if 'alpha' in query:
+            options['template_alpha'] = float(query['alpha'][-1])
+        if 'no-expand' in query:
+            options['expand_pages'] = not parse_bool(query['no-expand'][-1])
+        if 'only-annotated' in query:
+            options['only_annotated'] = parse_bool(query['only-annotated'][-1])
+        if 'compact' in query:
+            options['compact'] = parse_bool(query['compact'][-1])
+        if 'deterministic' in query:
+            options['deterministic'] = parse_bool(query['deterministic'][-1])
+        if 'compression-level' in query:
+            level = int(query['compression-level'][-1])
+            if not 0 <= level <= 9:
+                raise ValueError(f"Compression level must be from 0 to 9, not {level}")
+            options['compression_level'] = level
+        return options
+
+    def log_message(self, format, *args):
+        log.info(format % args)
+
+
+def parse_bool(value):
+    if value.lower() in ('', '1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Not a boolean value: {value!r}")
+
+def copy_limited(fsrc, fdst, length):
+    # Copy exactly length bytes, since the request stream doesn't end
+    while length > 0:
+        buf = fsrc.read(min(length, COPY_BUFSIZE))
+        if not buf:
+            raise EOFError("Request body ended early")
+        fdst.write(buf)
+        length -= len(buf)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m rmrl serve',
+        description="Run a server that renders Remarkable documents to PDF files.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on.  Defaults to localhost only.")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on.")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes.  Defaults to the number of CPUs.")
+    parser.add_argument('--queue', type=int, default=8, help="Number of requests that may wait for a worker before further requests are refused.")
+    add_render_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    server = RenderServer((args.host, args.port), render_options(args),
+                          jobs=args.jobs, queue_size=args.queue)
+    log.info(f"Listening on http://{args.host}:{server.server_port}/ with {server.jobs} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
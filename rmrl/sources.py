@@ -13,10 +13,23 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections import namedtuple
+import hashlib
 import io
+import json
+import logging
+import os
 from pathlib import Path
+import shutil
+import tempfile
+import threading
 import zipfile
 
+from .constants import CACHE_PATH, PREFETCH_PAGES, SPOOL_MAX
+
+
+log = logging.getLogger(__name__)
+
 __doc__ = """
 A Source should implement two methods:
 
@@ -77,11 +90,281 @@ class ZipSource:
             return False
 
 
+# A document or folder in a LibrarySource.  mtime is the latest modification
+# time of any of its files, and last_modified is the time recorded by the
+# device, both in seconds since the epoch.
+LibraryEntry = namedtuple('LibraryEntry', [
+    'id', 'name', 'parent', 'type', 'file_type', 'page_count', 'deleted',
+    'mtime', 'last_modified'])
+
+class LibrarySource:
+    # An index of all the documents in a xochitl data directory, as copied
+    # off the device.  Parsing thousands of .metadata and .content files
+    # is slow, so the index is cached in cache_path, and only the files of
+    # documents whose modification times have changed are read again.
+    # The page directories are listed on each refresh, to notice page
+    # files rewritten in place.
+    # Pass cache_path=False to not cache the index.
+
+    CACHE_VERSION = 2
+
+    def __init__(self, base_dir, cache_path=None):
+        self.base_dir = Path(base_dir)
+        if cache_path is None:
+            digest = hashlib.sha1(str(self.base_dir.resolve()).encode()).hexdigest()
+            cache_path = CACHE_PATH / f'library-{digest[:16]}.json'
+        self.cache_path = cache_path and Path(cache_path)
+        self.entries = {}
+        self.refresh()
+
+    def refresh(self):
+        # Bring the index up to date with the directory
+        cached = self.load_cache()
+        entries = {}
+        changed = False
+        for doc_id, key in self.cache_keys(self.scan()).items():
+            if doc_id in cached and cached[doc_id]['key'] == key:
+                entries[doc_id] = LibraryEntry(**cached[doc_id]['entry'])
+            else:
+                entries[doc_id] = self.index_document(
+                    doc_id, max(mtime for _, mtime in key))
+                cached[doc_id] = {'key': key, 'entry': entries[doc_id]._asdict()}
+                changed = True
+        self.entries = entries
+        if changed or len(cached) != len(entries):
+            self.save_cache({doc_id: cached[doc_id] for doc_id in entries})
+
+    def scan(self):
+        # Returns the modification time of everything in the directory,
+        # from a single listing.  Anything removed since the listing, as
+        # by a sync under way, is left out.
+        mtimes = {}
+        with os.scandir(self.base_dir) as it:
+            for entry in it:
+                try:
+                    mtimes[entry.name] = entry.stat().st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def cache_keys(self, mtimes):
+        # Returns the [name, mtime] of every file of each document, which
+        # key it in the cache.  These are the root-level files named by
+        # its ID and the files in its page directory, whose mtime doesn't
+        # change when a page file is rewritten in place.  Documents whose
+        # page directory vanishes while being listed are left out, to be
+        # indexed on a later refresh.
+        root_mtimes = {}
+        for name, mtime in mtimes.items():
+            root_mtimes.setdefault(name.split('.', 1)[0], []).append([name, mtime])
+        keys = {}
+        for name in mtimes:
+            if not name.endswith('.content'):
+                continue
+            doc_id = name[:-8]
+            key = list(root_mtimes[doc_id])
+            if doc_id in mtimes:
+                try:
+                    with os.scandir(self.base_dir / doc_id) as it:
+                        key.extend([f'{doc_id}/{entry.name}', entry.stat().st_mtime]
+                                   for entry in it)
+                except NotADirectoryError:
+                    pass
+                except OSError as e:
+                    log.debug(f"Skipping {doc_id}, which is changing: {e}")
+                    continue
+            keys[doc_id] = sorted(key)
+        return keys
+
+    def index_document(self, doc_id, mtime):
+        metadata = self.read_json(f'{doc_id}.metadata')
+        content = self.read_json(f'{doc_id}.content')
+        return LibraryEntry(
+            id=doc_id,
+            name=metadata.get('visibleName', doc_id),
+            parent=metadata.get('parent', ''),
+            type=metadata.get('type', 'DocumentType'),
+            file_type=content.get('fileType', ''),
+            page_count=content.get('pageCount', len(content.get('pages', []))),
+            deleted=metadata.get('deleted', False),
+            mtime=mtime,
+            last_modified=int(metadata.get('lastModified', 0)) / 1000)
+
+    def read_json(self, name):
+        try:
+            with (self.base_dir / name).open('r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def load_cache(self):
+        if not self.cache_path:
+            return {}
+        try:
+            with self.cache_path.open('r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if (cache.get('version') != self.CACHE_VERSION
+                or cache.get('base_dir') != str(self.base_dir.resolve())):
+            return {}
+        return cache['documents']
+
+    def save_cache(self, documents):
+        if not self.cache_path:
+            return
+        cache = {'version': self.CACHE_VERSION,
+                 'base_dir': str(self.base_dir.resolve()),
+                 'documents': documents}
+        tmp_path = self.cache_path.with_name(f'{self.cache_path.name}.{os.getpid()}.part')
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_path.open('w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            log.warning(f"Could not write library index to {self.cache_path}: {e}")
+
+    def documents(self, include_deleted=False):
+        # The documents, not folders, sorted by ID
+        return [entry for _, entry in sorted(self.entries.items())
+                if entry.type == 'DocumentType'
+                and (include_deleted or not entry.deleted)]
+
+    def modified_since(self, timestamp, include_deleted=False):
+        # The documents with files modified after timestamp, in seconds
+        # since the epoch
+        return [entry for entry in self.documents(include_deleted)
+                if entry.mtime > timestamp]
+
+    def source(self, doc_id):
+        if doc_id not in self.entries:
+            raise KeyError(doc_id)
+        return FSSource(self.base_dir, doc_id)
+
+    def __getitem__(self, doc_id):
+        return self.entries[doc_id]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class PrefetchSource:
+    # Wraps a Source, reading the files of upcoming pages on a background
+    # thread, so that reading and decompressing them overlaps with drawing
+    # the current page.  Call advance() as each page is started.  Only
+    # the files of the current page and the next lookahead pages are held
+    # in memory.  Files not read ahead are passed on to the source, which
+    # is all of them if lookahead is 0.
+
+    ERROR = object()
+
+    def __init__(self, source, page_ids, lookahead=PREFETCH_PAGES):
+        self.source = source
+        self.lookahead = lookahead
+        self.current = 0
+        self.closed = False
+        # Filename: (page, contents).  contents is None for files that
+        # don't exist, and ERROR for those that couldn't be read, which
+        # are left for the caller to try again and see the error.
+        self.cache = {}
+        self.cond = threading.Condition()
+
+        # The files that DocumentPage looks for.  The pagedata is read for
+        # every page, so it is kept for the whole document.
+        self.files = []
+        self.thread = None
+        if lookahead and page_ids:
+            self.files.append(('{ID}.pagedata', None))
+            for i, pid in enumerate(page_ids):
+                for name in (pid, str(i)):
+                    self.files.append((f'{{ID}}/{name}.rm', i))
+                    self.files.append((f'{{ID}}/{name}-metadata.json', i))
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.pages = dict(self.files)
+
+    def run(self):
+        for fn, page in self.files:
+            with self.cond:
+                self.cond.wait_for(lambda: self.closed or page is None
+                                   or page <= self.current + self.lookahead)
+                if self.closed:
+                    return
+            try:
+                contents = None
+                if self.source.exists(fn):
+                    with self.source.open(fn, 'rb') as f:
+                        contents = f.read()
+            except Exception:
+                contents = self.ERROR
+            with self.cond:
+                if page is None or page >= self.current:
+                    self.cache[fn] = (page, contents)
+                self.cond.notify_all()
+
+    def advance(self, page):
+        # Forget the files of earlier pages, and start reading later ones
+        with self.cond:
+            self.current = page
+            for fn, (fpage, _) in list(self.cache.items()):
+                if fpage is not None and fpage < page:
+                    del self.cache[fn]
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cache.clear()
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def lookup(self, fn):
+        # Returns the prefetched contents, or ERROR if fn isn't prefetched
+        page = self.pages.get(fn, self.ERROR)
+        if page is self.ERROR or (page is not None and page < self.current):
+            return self.ERROR
+        with self.cond:
+            # Wait for files of pages that are about to be read
+            self.cond.wait_for(lambda: fn in self.cache or self.closed
+                               or (page is not None
+                                   and page > self.current + self.lookahead))
+            return self.cache.get(fn, (None, self.ERROR))[1]
+
+    def open(self, fn, mode='r'):
+        contents = self.lookup(fn)
+        if contents is self.ERROR or contents is None:
+            return self.source.open(fn, mode)
+        f = io.BytesIO(contents)
+        if mode.endswith('b'):
+            return f
+        return io.TextIOWrapper(f, encoding='utf-8')
+
+    def exists(self, fn):
+        contents = self.lookup(fn)
+        if contents is self.ERROR:
+            return self.source.exists(fn)
+        return contents is not None
+
+
 def get_source(source):
     # Pass through objects that implement the source API
     if hasattr(source, 'open') and hasattr(source, 'exists'):
         return source
 
+    # A binary file object holding a zip file
+    if hasattr(source, 'read'):
+        if not (hasattr(source, 'seekable') and source.seekable()):
+            source = spool(source)
+        return ZipSource(zipfile.ZipFile(source))
+
     error = FileNotFoundError(f"Could not find a source file from {source!r}")
     try:
         source_p = Path(source)
@@ -100,3 +383,11 @@ def get_source(source):
         return FSSource(source_p.parent, source_p.stem)
 
     raise error
+
+def spool(stream, max_size=SPOOL_MAX):
+    # zipfile needs to seek, which pipes can't do.  So copy the stream to
+    # a temporary file, which is only kept in memory if it is small.
+    spooled = tempfile.SpooledTemporaryFile(max_size)
+    shutil.copyfileobj(stream, spooled, 1024 * 1024)
+    spooled.seek(0)
+    return spooled
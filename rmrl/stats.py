@@ -0,0 +1,131 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+import time
+
+__doc__ = """
+Pass a RenderStats object to render() to find out where the time goes.
+
+The stages of rendering are
+   parse: Reading the page files and parsing the strokes.
+   template: Drawing the template behind a page.
+   draw: Drawing the strokes of a page.
+   save: Writing out the drawn pages as a PDF.
+   read_pdf: Parsing the drawn pages and the base PDF with pdfrw.
+   merge: Combining the drawn pages with the base PDF.
+   compress: Compressing the content streams.
+   write: Writing the final PDF.
+
+For each, stages[name] holds a StageTiming with the number of times it ran,
+and the total wall-clock and CPU time (of the rendering thread) taken.
+
+pages is a list of PageStats, with the segments and time taken for each
+page.  bytes_read counts what was read from the source (characters, for
+files opened in text mode), and output_bytes is the size of the PDF file.
+
+If on_event is given, it is called as on_event(stage, page, wall, cpu) each
+time a stage finishes, with page set to None for document-wide stages.
+"""
+
+StageTiming = namedtuple('StageTiming', ['count', 'wall', 'cpu'])
+PageStats = namedtuple('PageStats', ['page', 'segments', 'vector', 'wall'])
+
+class RenderStats:
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.stages = {}
+        self.pages = []
+        self.bytes_read = 0
+        self.output_bytes = None
+
+    @contextmanager
+    def stage(self, name, page=None):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+            count, total_wall, total_cpu = self.stages.get(name, (0, 0, 0))
+            self.stages[name] = StageTiming(count + 1, total_wall + wall,
+                                            total_cpu + cpu)
+            if self.on_event is not None:
+                self.on_event(name, page, wall, cpu)
+
+    def add_page(self, page, segments, vector, wall):
+        self.pages.append(PageStats(page, segments, vector, wall))
+
+    def wrap_source(self, source):
+        return CountingSource(source, self)
+
+    def __repr__(self):
+        stages = ', '.join(f'{name}={timing.wall:.3f}s'
+                           for name, timing in self.stages.items())
+        return (f'<RenderStats {stages}, {len(self.pages)} pages, '
+                f'{self.bytes_read} bytes read, {self.output_bytes} bytes output>')
+
+
+def stage(stats, name, page=None):
+    # A context manager timing the stage, if stats is not None
+    if stats is None:
+        return nullcontext()
+    return stats.stage(name, page)
+
+
+class CountingSource:
+    # A Source that counts the bytes read from another
+
+    def __init__(self, source, stats):
+        self.source = source
+        self.stats = stats
+
+    def open(self, fn, mode='r'):
+        return CountingFile(self.source.open(fn, mode), self.stats)
+
+    def exists(self, fn):
+        return self.source.exists(fn)
+
+
+class CountingFile:
+
+    def __init__(self, f, stats):
+        self.f = f
+        self.stats = stats
+
+    def read(self, *args):
+        data = self.f.read(*args)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.f.readline(*args)
+        self.stats.bytes_read += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, self.f.read(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.f.close()
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
@@ -0,0 +1,288 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from functools import lru_cache
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+import re
+import uuid
+
+from . import document, sources
+from .constants import DISPLAY
+
+__doc__ = """
+Write the annotations of a document as SVG, without reportlab or pdfrw.
+
+An SvgCanvas provides the small part of the ReportLab canvas API that the
+pens use, but writes SVG <path> elements to a text file instead of a PDF
+content stream.  Like a RasterCanvas, it lets the pens draw SVG without
+knowing about it.
+
+The pens draw most strokes one segment at a time.  Segments that join up,
+with the same width and color, are collected into a single path.  The
+paths have no fill, which should be set by the element enclosing them.
+Textures are ignored.
+
+Templates are written once, in <defs>, and placed on each page by <use>.
+Pages are drawn and written one at a time, so only one is held in memory.
+"""
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_NS = 'http://www.w3.org/1999/xlink'
+# Device pixels between the pages of a single SVG file
+PAGE_GAP = 20
+
+CAPS = ('butt', 'round', 'square')
+JOINS = ('miter', 'round', 'bevel')
+
+def fmt(value):
+    # Numbers to two decimal places, without trailing zeros
+    return f'{value:.2f}'.rstrip('0').rstrip('.')
+
+def svg_color(color, alpha=1):
+    # Returns the color as #rrggbb, and the opacity, clipped to at most 1
+    return (f'#{round(255 * color[0]):02x}{round(255 * color[1]):02x}{round(255 * color[2]):02x}',
+            min(alpha, 1))
+
+
+class SvgPath:
+
+    def __init__(self):
+        self.points = []
+
+    def moveTo(self, x, y):
+        self.points = [(x, y)]
+
+    def lineTo(self, x, y):
+        self.points.append((x, y))
+
+
+class SvgCanvas:
+
+    def __init__(self, out):
+        self.out = out
+        self.state = dict(width=1, cap=0, join=0, color=(0, 0, 0), alpha=1)
+        self.saved = []
+        # The style and points of the path being built up
+        self.run = None
+
+    def saveState(self):
+        self.saved.append(dict(self.state))
+
+    def restoreState(self):
+        self.state = self.saved.pop()
+
+    def setLineWidth(self, width):
+        self.state['width'] = width
+
+    def setLineCap(self, cap):
+        self.state['cap'] = cap
+
+    def setLineJoin(self, join):
+        self.state['join'] = join
+
+    def setStrokeColor(self, color, alpha=None):
+        self.state['color'] = tuple(color)
+        if alpha is not None:
+            self.state['alpha'] = alpha
+
+    def setStrokeTexture(self, texture):
+        pass
+
+    def line(self, x1, y1, x2, y2):
+        style = self.style()
+        start, end = (fmt(x1), fmt(y1)), (fmt(x2), fmt(y2))
+        if self.run and self.run[0] == style and self.run[1][-1] == start:
+            self.run[1].append(end)
+        else:
+            self.flush()
+            self.run = (style, [start, end])
+
+    def beginPath(self):
+        return SvgPath()
+
+    def drawPath(self, path, stroke=1, fill=0):
+        self.flush()
+        if stroke and path.points:
+            self.run = (self.style(), [(fmt(x), fmt(y)) for x, y in path.points])
+            self.flush()
+
+    def style(self):
+        state = self.state
+        color, alpha = svg_color(state["color"], state["alpha"])
+        opacity = f' stroke-opacity="{fmt(alpha)}"' if alpha < 1 else ''
+        return (f' stroke="{color}"{opacity}'
+                f' stroke-width="{fmt(state["width"])}"'
+                f' stroke-linecap="{CAPS[state["cap"]]}"'
+                f' stroke-linejoin="{JOINS[state["join"]]}"')
+
+    def flush(self):
+        # Writes out the path being built up
+        if self.run is None:
+            return
+        style, points = self.run
+        (x, y), *rest = points
+        # A single point is drawn as a dot, by its line caps
+        rest = rest or [(x, y)]
+        self.out.write(f'<path d="M{x} {y}L{" ".join(f"{x} {y}" for x, y in rest)}"{style}/>\n')
+        self.run = None
+
+
+@lru_cache(maxsize=16)
+def template_svg(template_path):
+    # The template's <svg> element, sized to cover the page
+    import xml.etree.ElementTree as ET
+
+    ET.register_namespace('', SVG_NS)
+    root = ET.parse(template_path).getroot()
+    if 'viewBox' not in root.attrib:
+        size = [re.match(r'[\d.]*', root.get(name, '')).group() or default
+                for name, default in (('width', DISPLAY['screenwidth']),
+                                      ('height', DISPLAY['screenheight']))]
+        root.set('viewBox', f'0 0 {size[0]} {size[1]}')
+    root.set('x', '0')
+    root.set('y', '0')
+    root.set('width', str(DISPLAY['screenwidth']))
+    root.set('height', str(DISPLAY['screenheight']))
+    return ET.tostring(root, encoding='unicode')
+
+def template_id(template_path):
+    return 'template-' + hashlib.sha1(template_path.encode()).hexdigest()[:16]
+
+def template_def(template_path):
+    return f'<defs><g id="{template_id(template_path)}">{template_svg(template_path)}</g></defs>\n'
+
+def page_body(page, template_alpha):
+    # The template and strokes of a page, in device pixels
+    out = io.StringIO()
+    out.write(f'<rect width="{DISPLAY["screenwidth"]}" height="{DISPLAY["screenheight"]}" fill="white"/>\n')
+    if page.template and template_alpha > 0:
+        out.write(f'<use xlink:href="#{template_id(page.template)}" opacity="{fmt(template_alpha)}"/>\n')
+    out.write('<g fill="none">\n')
+    strokes = SvgCanvas(out)
+    for layer in page.layers:
+        layer.paint_strokes(strokes, vector=True)
+    strokes.flush()
+    out.write('</g>\n')
+    return out.getvalue()
+
+def svg_header(width, height):
+    return (f'<svg xmlns="{SVG_NS}" xmlns:xlink="{XLINK_NS}" width="{width}" '
+            f'height="{height}" viewBox="0 0 {width} {height}">\n')
+
+def document_pages(source):
+    source = sources.get_source(source)
+    pages = []
+    if source.exists('{ID}.content'):
+        with source.open('{ID}.content', 'r') as f:
+            pages = json.load(f).get('pages', [])
+    for i, pid in enumerate(pages):
+        yield document.DocumentPage(source, pid, i)
+
+def svg_pages(source, template_alpha=0.3):
+    """
+    Generate an SVG file for each page of a document.
+
+    source: The reMarkable document, as for render().
+    template_alpha: Opacity of the pages' templates.  0 leaves them out.
+
+    Each page is read and drawn only when the next file is asked for.
+    Only the annotations and templates are drawn, not the pages of a base
+    PDF.  Yields the text of each file.
+    """
+    width, height = DISPLAY['screenwidth'], DISPLAY['screenheight']
+    for page in document_pages(source):
+        defs = template_def(page.template) if page.template and template_alpha > 0 else ''
+        yield f'{svg_header(width, height)}{defs}{page_body(page, template_alpha)}</svg>\n'
+
+def render_svg_to(source, dest, template_alpha=0.3):
+    """
+    Write all of the pages of a document to a single SVG file.
+
+    source: The reMarkable document, as for render().
+    dest: A filename or pathlib.Path, or a writable binary file object.
+          A file is written under a temporary name and renamed to dest
+          once complete.
+    template_alpha: Opacity of the pages' templates.  0 leaves them out.
+
+    The pages are stacked from top to bottom, as <g id="page-1"> and so
+    on.  Each template is written once and shared by the pages that use
+    it.  Pages are written out as they are drawn.  Returns the number of
+    bytes written.
+    """
+    if not hasattr(dest, 'write'):
+        # Written under a temporary name, as by render_to()
+        dest = Path(dest)
+        tmp_path = dest.with_name(f'.{dest.name}.{uuid.uuid4().hex[:8]}.part')
+        try:
+            with open(tmp_path, 'xb') as fout:
+                nbytes = render_svg_to(source, fout, template_alpha)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise
+        return nbytes
+
+    source = sources.get_source(source)
+    n_pages = 0
+    if source.exists('{ID}.content'):
+        with source.open('{ID}.content', 'r') as f:
+            n_pages = len(json.load(f).get('pages', []))
+    width, page_height = DISPLAY['screenwidth'], DISPLAY['screenheight']
+    height = max(n_pages * (page_height + PAGE_GAP) - PAGE_GAP, 0)
+
+    nbytes = dest.write(svg_header(width, height).encode())
+    written = set()
+    for page in document_pages(source):
+        text = ''
+        # Each template is defined just before the first page using it
+        if page.template and template_alpha > 0 and page.template not in written:
+            written.add(page.template)
+            text += template_def(page.template)
+        text += (f'<g id="page-{page.num + 1}" transform="translate(0 '
+                 f'{page.num * (page_height + PAGE_GAP)})">\n'
+                 f'{page_body(page, template_alpha)}</g>\n')
+        nbytes += dest.write(text.encode())
+    nbytes += dest.write(b'</svg>\n')
+    return nbytes
+
+def main(argv):
+    import argparse
+    from pathlib import Path
+    import sys
+
+    parser = argparse.ArgumentParser(prog='python -m rmrl svg',
+        description="Write the annotations of a Remarkable document as SVG.")
+    parser.add_argument('input', help="Filename of zip file, or root-level unpacked file of document.  Use '-' to read zip file from stdin.")
+    parser.add_argument('output', nargs='?', default='', help="Filename where SVG file should be written, or directory with --split.  Omit to write to stdout.")
+    parser.add_argument('--split', action='store_true', help="Write each page to its own file, 1.svg, 2.svg, and so on, in the output directory.")
+    parser.add_argument('--alpha', type=float, default=0.3, help="Opacity for template background (0 for no background).")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin.buffer if args.input == '-' else args.input
+    if args.split:
+        if not args.output:
+            parser.error("--split needs an output directory")
+        output_dir = Path(args.output)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for i, text in enumerate(svg_pages(source, template_alpha=args.alpha)):
+            (output_dir / f'{i + 1}.svg').write_text(text)
+    else:
+        render_svg_to(source, args.output or sys.stdout.buffer, template_alpha=args.alpha)
+    return 0
@@ -0,0 +1,178 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from functools import lru_cache
+import io
+import json
+import logging
+from pathlib import Path
+
+from . import document, lines, pens, sources
+from .constants import DISPLAY, PDFHEIGHT, PTPERPX
+
+__doc__ = """
+Draw small images of pages quickly, for browsing a library.
+
+The strokes are read straight from the page's .rm file and drawn as plain
+lines into a small image, skipping the pens, the PDF machinery, and any
+base PDF.  Points closer together than the image can show are dropped.
+The template is only drawn when asked for, and is rendered once for each
+size and kept.
+"""
+
+# Width of the image, in pixels, unless another is asked for
+THUMBNAIL_WIDTH = 156
+FORMATS = ('png', 'jpeg', 'webp')
+# Points in a stroke are about this many device pixels apart
+POINT_SPACING = 2
+# Pixels of the image between the points of a stroke that are kept
+SIMPLIFY_PIXELS = 2
+# Opacity of highlighters, out of 255
+HIGHLIGHT_ALPHA = 100
+
+log = logging.getLogger(__name__)
+
+def render_thumbnail(source, page=0, width=THUMBNAIL_WIDTH, template=False,
+                     template_alpha=0.3, format='png'):
+    """
+    Draw a small image of one page of a document.
+
+    source: The reMarkable document, as for render().
+    page: The index of the page, starting from 0.
+    width: The width of the image, in pixels.  The height follows from the
+           shape of the device's screen.
+    template: Whether to draw the page's template behind the strokes.
+    template_alpha: Opacity of the template, if it is drawn.
+    format: 'png' (default), 'jpeg', or 'webp'.
+
+    Strokes are drawn as simple lines, without the pens' textures or
+    varying widths, and the page of a base PDF is left out.  Returns the
+    bytes of the image.
+    """
+    if format not in FORMATS:
+        raise ValueError(f"Unknown format {format!r}")
+    if width < 1:
+        raise ValueError(f"Thumbnail must be at least 1 pixel wide, not {width}")
+    image = thumbnail_image(sources.get_source(source), page, width,
+                            template_alpha if template else 0)
+    out = io.BytesIO()
+    image.save(out, format.upper())
+    return out.getvalue()
+
+def thumbnail_image(source, page, width, template_alpha):
+    from PIL import Image, ImageDraw
+
+    pages = []
+    if source.exists('{ID}.content'):
+        with source.open('{ID}.content', 'r') as f:
+            pages = json.load(f).get('pages', [])
+    if not 0 <= page < len(pages):
+        raise IndexError(f"Page {page} not in document of {len(pages)} pages")
+
+    scale = width / DISPLAY['screenwidth']
+    height = max(round(DISPLAY['screenheight'] * scale), 1)
+    template_path = document.page_template(source, page) if template_alpha > 0 else None
+    if template_path:
+        # A copy, since the cached image is shared
+        image = template_image(template_path, width, height, template_alpha).copy()
+    else:
+        image = Image.new('RGB', (width, height), (255, 255, 255))
+
+    rmpath = document.page_rmpath(source, pages[page], page)
+    if not source.exists(rmpath):
+        return image
+    # Reading many small pieces from a zip file is slow, so read it all
+    with source.open(rmpath, 'rb') as f:
+        _, layers = lines.readPoints(io.BytesIO(f.read()))
+
+    draw = ImageDraw.Draw(image, 'RGBA')
+    step = max(int(SIMPLIFY_PIXELS / (POINT_SPACING * scale)), 1)
+    for layer in layers:
+        for stroke in layer:
+            penclass = pens.PEN_MAPPING.get(stroke.pen)
+            if penclass is pens.EraserPen or not stroke.xs:
+                continue
+            if penclass is pens.HighlighterPen:
+                fill = (255, 233, 74, HIGHLIGHT_ALPHA)
+            else:
+                color = document.COLORS[stroke.color] if stroke.color < len(document.COLORS) else (0, 0, 0)
+                fill = tuple(round(255 * c) for c in color)
+            # Keep every step'th point, and always the last
+            xs, ys = stroke.xs[::step], stroke.ys[::step]
+            if (len(stroke.xs) - 1) % step:
+                xs.append(stroke.xs[-1])
+                ys.append(stroke.ys[-1])
+            points = [(x * scale, y * scale) for x, y in zip(xs, ys)]
+            if len(points) == 1:
+                points.append(points[0])
+            draw.line(points, fill=fill, width=max(round(stroke.width * scale), 1))
+    return image
+
+@lru_cache(maxsize=16)
+def template_image(template_path, width, height, template_alpha):
+    # The template, faded onto white, at the size of a thumbnail.  A
+    # library uses only a few templates, so this is rarely drawn.
+    from PIL import Image
+    from reportlab.graphics import renderPM
+    from reportlab.graphics.shapes import Drawing, Group
+
+    # The template is in points, with y running upwards
+    m = width / (DISPLAY['screenwidth'] * PTPERPX)
+    drawing = Drawing(width, height)
+    drawing.add(Group(document.load_template(template_path),
+                      transform=(m, 0, 0, m, 0, height - PDFHEIGHT * m)))
+    with document.TEMPLATE_LOCK:
+        background = renderPM.drawToPIL(drawing, dpi=72).convert('RGB')
+    white = Image.new('RGB', (width, height), (255, 255, 255))
+    return Image.blend(white, background.resize((width, height)), template_alpha)
+
+def main(argv):
+    # Only needed from the command line, and slow to import
+    import argparse
+    import time
+    from .batch import find_documents
+
+    parser = argparse.ArgumentParser(prog='python -m rmrl thumbnail',
+        description="Draw small images of pages of Remarkable documents.")
+    parser.add_argument('input', nargs='+', help="Zip files, root-level unpacked files of documents, or directories holding either, such as a xochitl data directory.")
+    parser.add_argument('-o', '--output-dir', required=True, help="Directory where images should be written.")
+    parser.add_argument('--page', type=int, default=0, help="Index of the page to draw, starting from 0.")
+    parser.add_argument('--width', type=int, default=THUMBNAIL_WIDTH, help="Width of the images, in pixels.")
+    parser.add_argument('--template', action='store_true', help="Draw the page templates behind the strokes.")
+    parser.add_argument('--alpha', type=float, default=0.3, help="Opacity of the templates.")
+    parser.add_argument('--format', default='png', choices=FORMATS, help="Image format.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(message)s')
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    drawn = failed = 0
+    start = time.perf_counter()
+    for doc in find_documents(args.input):
+        try:
+            data = render_thumbnail(doc.source, page=args.page, width=args.width,
+                                    template=args.template, template_alpha=args.alpha,
+                                    format=args.format)
+        except Exception as e:
+            log.error(f"Failed to draw {doc.source}: {e}")
+            failed += 1
+            continue
+        (output_dir / f'{doc.name}.{args.format}').write_bytes(data)
+        drawn += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"Drew {drawn} thumbnails in {elapsed:.2f} s "
+          f"({drawn / elapsed:.0f} thumbnails/s); {failed} failed")
+    return 1 if failed else 0
@@ -0,0 +1,215 @@
+# Copyright 2021 Robert Schroll
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+
+from .cli import add_render_arguments, render_options
+from .sources import LibrarySource
+
+
+log = logging.getLogger(__name__)
+
+__doc__ = """
+Keep PDF files of the documents in a xochitl data directory up to date.
+
+The directory is polled for documents whose files have changed.  Once a
+document has gone unchanged for the debounce time, so that a sync has
+finished with it, the contents of its files are compared to those of the
+last render, and it is rendered again only if they differ.  These hashes
+are kept in a state file in the output directory, with the render options,
+so that nothing is rendered again needlessly after a restart.  Changing
+the options renders every document again.
+
+Files may vanish while a sync is under way.  A document whose files can't
+be read is taken to be changing, and is looked at again on a later poll.
+"""
+
+STATE_FILE = '.rmrl-watch.json'
+# The files that go into rendering a document, at the root level and in
+# the page directory
+ROOT_SUFFIXES = ('.content', '.pagedata', '.pdf')
+PAGE_SUFFIXES = ('.rm', '-metadata.json')
+
+def document_files(base_dir, doc_id):
+    # Yields the name and path of each file used to render the document
+    for suffix in ROOT_SUFFIXES:
+        path = base_dir / f'{doc_id}{suffix}'
+        if path.is_file():
+            yield path.name, path
+    page_dir = base_dir / doc_id
+    if page_dir.is_dir():
+        for path in sorted(page_dir.iterdir()):
+            if path.name.endswith(PAGE_SUFFIXES):
+                yield f'{doc_id}/{path.name}', path
+
+def document_signature(base_dir, doc_id):
+    # The name, mtime, and size of each of the document's files
+    signature = []
+    for name, path in document_files(base_dir, doc_id):
+        stat = path.stat()
+        signature.append((name, stat.st_mtime, stat.st_size))
+    return signature
+
+def file_states(base_dir, doc_id, old_states):
+    # Returns [mtime, size, digest] for each of the document's files.  Only
+    # files whose mtime or size have changed are hashed again.
+    states = {}
+    for name, path in document_files(base_dir, doc_id):
+        stat = path.stat()
+        old = old_states.get(name)
+        if old and old[:2] == [stat.st_mtime, stat.st_size]:
+            states[name] = old
+        else:
+            states[name] = [stat.st_mtime, stat.st_size, hash_file(path)]
+    return states
+
+def hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def changed_files(old_states, new_states):
+    return sorted(name for name in set(old_states) | set(new_states)
+                  if old_states.get(name, [None] * 3)[2]
+                  != new_states.get(name, [None] * 3)[2])
+
+
+class Watcher:
+
+    def __init__(self, src, dest, options, debounce=5):
+        self.library = LibrarySource(src)
+        self.dest = Path(dest)
+        self.dest.mkdir(parents=True, exist_ok=True)
+        self.options = options
+        self.debounce = debounce
+        self.state_path = self.dest / STATE_FILE
+        try:
+            with self.state_path.open('r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        # The file states of each document at its last render.  These only
+        # count if the documents were rendered with the same options, as
+        # they look after a round trip through JSON.
+        self.state = {}
+        if state.get('options') == json.loads(json.dumps(options)):
+            self.state = state.get('documents', {})
+        # The mtimes and sizes of each document's files when last polled,
+        # and when documents that have changed since were first seen to
+        # change.
+        self.seen = {}
+        self.pending = {}
+
+    def poll(self, now=None):
+        # Renders the documents that have changed, and not changed again
+        # for the debounce time.  Returns the number rendered.
+        now = time.monotonic() if now is None else now
+        self.library.refresh()
+        for entry in self.library.documents():
+            # The library only notices changes to the page directory, not
+            # to the page files within it, so check those too.
+            try:
+                signature = document_signature(self.library.base_dir, entry.id)
+            except OSError as e:
+                log.debug(f"Could not read {entry.id}: {e}")
+                self.seen[entry.id] = None
+                self.pending[entry.id] = now
+                continue
+            if self.seen.get(entry.id) != signature:
+                # Documents are ready right away on the first poll
+                first = entry.id not in self.seen
+                self.seen[entry.id] = signature
+                self.pending[entry.id] = now - self.debounce if first else now
+
+        rendered = 0
+        for doc_id, changed_at in list(self.pending.items()):
+            if now - changed_at >= self.debounce:
+                del self.pending[doc_id]
+                try:
+                    rendered += self.update(doc_id)
+                except OSError as e:
+                    # A file went away in the middle of a sync
+                    log.info(f"Could not read {doc_id}, will try again: {e}")
+                    self.seen[doc_id] = None
+                    self.pending[doc_id] = now
+        return rendered
+
+    def update(self, doc_id):
+        # Renders the document if its files have changed.  Returns whether
+        # it was rendered.  Raises OSError if the document's files can't be
+        # read, which may be fixed by trying again later.
+        output_path = self.dest / f'{doc_id}.pdf'
+        old_states = self.state.get(doc_id, {})
+        states = file_states(self.library.base_dir, doc_id, old_states)
+        changed = changed_files(old_states, states)
+        if not changed and output_path.exists():
+            log.debug(f"{doc_id} is unchanged")
+            return False
+
+        from .render import render_to
+
+        log.info(f"Rendering {doc_id}, with changes to {', '.join(changed) or 'nothing'}")
+        try:
+            render_to(self.library.source(doc_id), output_path, **self.options)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            log.error(f"Failed to render {doc_id}: {e}")
+            return False
+        self.state[doc_id] = states
+        self.save_state()
+        return True
+
+    def save_state(self):
+        tmp_path = self.state_path.with_name(self.state_path.name + '.part')
+        with tmp_path.open('w') as f:
+            json.dump({'options': self.options, 'documents': self.state}, f)
+        os.replace(tmp_path, self.state_path)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m rmrl watch',
+        description="Keep PDF files of the documents in a xochitl data directory up to date.")
+    parser.add_argument('src', help="xochitl data directory to watch.")
+    parser.add_argument('dest', help="Directory where PDF files should be written.")
+    parser.add_argument('--interval', type=float, default=2, help="Seconds between checks for changes.")
+    parser.add_argument('--debounce', type=float, default=5, help="Seconds a document must go unchanged before it is rendered.")
+    parser.add_argument('--once', action='store_true', help="Render the changed documents, and then exit.")
+    add_render_arguments(parser)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
+    watcher = Watcher(args.src, args.dest, render_options(args), args.debounce)
+    try:
+        while True:
+            watcher.poll()
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))